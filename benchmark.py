@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from search import chunk_files, get_pool, process_file, process_files
+from search_index import INDEX_FOLDER, TranscriptIndex
+from transcripts import JSON_DECODERS, decode_transcript, list_transcripts
+
+DEFAULT_QUERIES = [
+    "luikautus",
+    "luikatus",
+    "joulua",
+    "jolua",
+    "odotellessa",
+    "odotelesa",
+    "kahvia",
+    "kahvai",
+    "niilo",
+    "nilo",
+]
+
+def read_queries(queries_file):
+    """
+    Read one query per line from a text file, skipping empty lines.
+    """
+    with open(queries_file, 'r', encoding='utf-8') as f:
+        return [line.strip().lower() for line in f if line.strip()]
+
+def scan_search(executor, json_files, output_folder, search_word, threshold):
+    """
+    The original search path: every worker loads a whole transcript and scores every word.
+    """
+    matches = []
+    for file_matches in executor.map(
+        process_file,
+        json_files,
+        [output_folder] * len(json_files),
+        [search_word] * len(json_files),
+        [threshold] * len(json_files),
+        chunksize=1
+    ):
+        matches.extend(file_matches)
+    return matches
+
+def per_file_search(json_files, output_folder, search_word, threshold, max_workers):
+    """
+    The original scheduling: a fresh pool per search and one future per file.
+    """
+    matches = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_file, f, output_folder, search_word, threshold) for f in json_files]
+        for future in as_completed(futures):
+            matches.extend(future.result())
+    return matches
+
+def chunked_search(json_files, output_folder, search_word, threshold, max_workers):
+    """
+    The chunked scheduling: a persistent pool and largest-first chunks.
+    """
+    workers = max_workers or os.cpu_count()
+    executor = get_pool(workers)
+    futures = [
+        executor.submit(process_files, chunk, output_folder, search_word, threshold)
+        for chunk in chunk_files(json_files, output_folder, workers)
+    ]
+    matches = []
+    for future in as_completed(futures):
+        matches.extend(future.result())
+    return matches
+
+def benchmark_scheduling(queries, json_files, args):
+    """
+    Compare per-file task submission against chunked submission on a persistent pool.
+    """
+    print(f"Scheduling: {len(json_files)} files, {args.workers or os.cpu_count()} workers\n")
+    reference = time_queries(
+        "per-file",
+        queries,
+        lambda query: per_file_search(json_files, args.output_folder, query, args.threshold, args.workers)
+    )
+    time_queries(
+        "chunked",
+        queries,
+        lambda query: chunked_search(json_files, args.output_folder, query, args.threshold, args.workers),
+        reference
+    )
+
+def benchmark_parsing(json_files, args, rounds=3):
+    """
+    Compare the old transcript parsing (stdlib json into dicts) with the shared reader's
+    decoders over the whole output folder. Files are read into memory first so only
+    decoding is timed; each decoder keeps its best of a few rounds.
+    """
+    contents = []
+    for json_file in json_files:
+        with open(os.path.join(args.output_folder, json_file), 'rb') as f:
+            contents.append(f.read())
+    total_bytes = sum(len(data) for data in contents)
+    print(f"Parsing: {len(contents)} files, {total_bytes / (1024 ** 2):.1f} MB\n")
+
+    def parse_dicts(data):
+        return json.loads(data).get('words', [])
+
+    def parse_columns(decoder):
+        return lambda data: decode_transcript(data, decoder)
+
+    baseline = None
+    for name, parse in [("json dicts", parse_dicts)] + [(f"{decoder} columns", parse_columns(decoder)) for decoder in JSON_DECODERS]:
+        best = None
+        for _ in range(rounds):
+            start_time = time.perf_counter()
+            for data in contents:
+                try:
+                    parse(data)
+                except ValueError:
+                    pass  # Invalid files cost the same failed parse for every decoder
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print(
+            f"{name:<16} {best:8.3f} s | {total_bytes / (1024 ** 2) / best:8.1f} MB/s | "
+            f"saves {baseline - best:7.3f} s ({baseline / best:.1f}x)"
+        )
+
+def match_keys(matches):
+    """
+    Return the set of (video, word, start, end) tuples identifying the matches.
+    """
+    return {(m["video_id"], m["matched_word"], m["start_time"], m["end_time"]) for m in matches}
+
+def time_queries(name, queries, search, reference=None):
+    """
+    Run every query once, print latency statistics and return the matches per query.
+    """
+    timings = []
+    results = []
+    for query in queries:
+        start_time = time.perf_counter()
+        results.append(search(query))
+        timings.append((time.perf_counter() - start_time) * 1000)
+
+    total_matches = sum(len(matches) for matches in results)
+    line = (
+        f"{name:<10} median {statistics.median(timings):9.2f} ms | max {max(timings):9.2f} ms | "
+        f"{total_matches} matches"
+    )
+    if reference is not None:
+        found = sum(len(match_keys(matches) & match_keys(expected)) for matches, expected in zip(results, reference))
+        expected_total = sum(len(match_keys(expected)) for expected in reference)
+        line += f" | recall vs reference {found / expected_total * 100 if expected_total else 100:.1f}%"
+    print(line)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare search engine latency on the same query set.")
+    parser.add_argument(
+        "--mode",
+        choices=["engines", "scheduling", "parsing"],
+        default="engines",
+        help=(
+            "'engines' compares search engines, 'scheduling' compares how the scan is split into tasks, "
+            "'parsing' compares the JSON decoders over the output folder."
+        )
+    )
+    parser.add_argument("--queries", help="Text file with one query per line. Defaults to a built-in list.")
+    parser.add_argument("--threshold", type=int, default=80, help="Minimum fuzzy similarity score (0-100).")
+    parser.add_argument("--max-edit-distance", type=int, default=2, help="Maximum edit distance for 'symspell'.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the scan path.")
+    parser.add_argument("--output-folder", default="output", help="Folder containing transcription JSON files.")
+    parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder containing the index.")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries) if args.queries else DEFAULT_QUERIES
+    json_files = list_transcripts(args.output_folder)
+    if args.mode == "parsing":
+        benchmark_parsing(json_files, args)
+        return
+    print(f"{len(queries)} queries, {len(json_files)} transcripts, threshold {args.threshold}\n")
+    if args.mode == "scheduling":
+        benchmark_scheduling(queries, json_files, args)
+        return
+
+    start_time = time.perf_counter()
+    index = TranscriptIndex.load(args.index_folder)
+    index.deletion_index(args.max_edit_distance)
+    index.bk_tree()
+    print(f"Index loaded in {time.perf_counter() - start_time:.2f} seconds.\n")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        reference = time_queries(
+            "scan",
+            queries,
+            lambda query: scan_search(executor, json_files, args.output_folder, query, args.threshold)
+        )
+    time_queries("vocab", queries, lambda query: index.fuzzy_search(query, args.threshold), reference)
+    time_queries(
+        "symspell",
+        queries,
+        lambda query: index.symspell_search(query, args.threshold, args.max_edit_distance),
+        reference
+    )
+    time_queries("bktree", queries, lambda query: index.bktree_search(query, args.threshold), reference)
+    time_queries("stem", queries, lambda query: index.stem_search(query), reference)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import os
-import json
+import sys
 from tqdm import tqdm  # Import tqdm for the progress bar
+from transcript_store import TranscriptStore
+from transcripts import read_transcript_words
 
 def create_sentences_from_json(output_folder, output_file):
     """
@@ -17,15 +19,11 @@ def create_sentences_from_json(output_folder, output_file):
             file_path = os.path.join(output_folder, file_name)
             
             # Open and parse the JSON file
-            with open(file_path, 'r', encoding='utf-8') as json_file:
-                data = json.load(json_file)
-                words = data.get("words", [])
-                
+            transcript = read_transcript_words(file_path)
+            if transcript is not None:
                 # Extract and clean words
                 sentence = ""
-                for word_info in words:
-                    word = word_info.get("word", "")
-                    
+                for word in transcript.words:
                     # Add a space after punctuation if needed
                     if word.endswith((",", ".", "?", "!", ":")):
                         sentence += word + " "
@@ -46,9 +44,30 @@ def create_sentences_from_json(output_folder, output_file):
     
     print(f"\nText file '{output_file}' created successfully with content from JSON files.")
 
+def create_sentences_from_store(store_path, output_file):
+    """
+    Same as create_sentences_from_json, but reads the words from a binary transcript
+    store (built by 'python transcript_store.py', or the index built by 'python search.py index')
+    instead of parsing every JSON file. The store holds the transcripts as they were when it
+    was built, without files whose names do not parse as video info.
+    """
+    store = TranscriptStore(store_path)
+    with open(output_file, 'w', encoding='utf-8') as text_file:
+        for video in tqdm(range(len(store.videos)), desc="Processing videos", unit="video"):
+            sentence = " ".join(store.video_words(video)).strip()
+            if sentence:
+                text_file.write(sentence + "\n")
+    store.close()
+
+    print(f"\nText file '{output_file}' created successfully with content from '{store_path}'.")
+
 # Define paths
 output_folder = "output"  # Folder containing JSON files
 output_file = "combined_words.txt"  # Output text file
 
-# Execute the function
-create_sentences_from_json(output_folder, output_file)
+# Execute the function. Usage: python concat.py [store_path]
+# With a store path the words are read from that store instead of the JSON files.
+if len(sys.argv) > 1:
+    create_sentences_from_store(sys.argv[1], output_file)
+else:
+    create_sentences_from_json(output_folder, output_file)
@@ -1,9 +1,12 @@
 import os
+import sys
 import time
 import psutil
 import pynvml
 import threading
 from faster_whisper import WhisperModel, BatchedInferencePipeline
+from transcript_store import DEFAULT_STORE_PATH, TranscriptStore
+from transcripts import read_transcript_words
 
 def get_ram_usage():
     """
@@ -107,6 +110,54 @@ def memory_monitor(stop_event, handle, interval=1):
             print(f"    [Memory] RAM: {used_ram:.2f} GB / {total_ram:.2f} GB | VRAM: N/A")
         time.sleep(interval)
 
+def get_process_ram_usage():
+    """
+    Retrieves the resident memory of the current process.
+
+    Returns:
+        float: Resident memory in megabytes (MB).
+    """
+    return psutil.Process().memory_info().rss / (1024 ** 2)
+
+def measure_transcript_loading(output_folder="output", store_path=DEFAULT_STORE_PATH):
+    """
+    Compares loading every transcription JSON file against loading the binary transcript store.
+    The store side decodes the vocabulary and reads every word's token id and timestamps,
+    so both sides have touched all the transcript data they measure.
+
+    Args:
+        output_folder (str): Folder containing the transcription JSON files.
+        store_path (str): Path of the store built by 'python transcript_store.py'.
+    """
+    json_files = [os.path.join(output_folder, f) for f in os.listdir(output_folder) if f.endswith(".json")]
+    json_bytes = sum(os.path.getsize(path) for path in json_files)
+
+    ram_before = get_process_ram_usage()
+    start_time = time.time()
+    transcripts = []
+    for path in json_files:
+        transcripts.append(read_transcript_words(path))
+    json_elapsed = time.time() - start_time
+    json_ram = get_process_ram_usage() - ram_before
+    print(f"JSON:  {len(json_files)} files, {json_bytes / (1024 ** 2):.1f} MB on disk, loaded in {json_elapsed:.2f} seconds (+{json_ram:.1f} MB RAM)")
+    del transcripts
+
+    ram_before = get_process_ram_usage()
+    start_time = time.time()
+    store = TranscriptStore(store_path)
+    vocabulary = store.vocabulary
+    # Reductions read every page of the columns
+    int(store.token_ids.max(initial=0)), int(store.start_ms.sum()), int(store.end_ms.sum())
+    word_count = store.word_count
+    store_elapsed = time.time() - start_time
+    store_ram = get_process_ram_usage() - ram_before
+    store_bytes = os.path.getsize(store_path)
+    print(
+        f"Store: {word_count} words, {len(vocabulary)} distinct, {store_bytes / (1024 ** 2):.1f} MB on disk, "
+        f"loaded in {store_elapsed:.4f} seconds (+{store_ram:.1f} MB RAM)"
+    )
+    store.close()
+
 def main():
     # Initialize NVML to access GPU information
     pynvml.nvmlInit()
@@ -173,4 +224,9 @@ def main():
         pynvml.nvmlShutdown()
 
 if __name__ == "__main__":
-    main()
+    # Usage: python measure.py                                          Whisper memory benchmark
+    #        python measure.py --loading [output_folder] [store_path]   JSON vs. store loading
+    if sys.argv[1:2] == ["--loading"]:
+        measure_transcript_loading(*sys.argv[2:4])
+    else:
+        main()
@@ -0,0 +1,430 @@
+import numpy as np
+
+# Positions per block. A full block of 128 deltas of w bits takes exactly 16 * w bytes;
+# the last block of a term only takes the bytes of its own deltas.
+BLOCK_SIZE = 128
+# Zero bytes after the last block, so decoding can always read a full block's bytes
+_PACKED_PADDING = BLOCK_SIZE // 8 * 32
+
+_BIT_THRESHOLDS = np.uint64(1) << np.arange(32, dtype=np.uint64)
+
+def bit_widths(values):
+    """
+    Return the number of bits needed for each non-negative value (0 for 0).
+    """
+    return (values.astype(np.uint64)[:, None] >= _BIT_THRESHOLDS).sum(axis=1).astype(np.uint8)
+
+def _word_layout(width):
+    """
+    Return the 64-bit word and the bit shift of each of the BLOCK_SIZE deltas of a block
+    packed with the given bit width. Delta j takes bits j * width to (j + 1) * width - 1
+    of the block, little-endian, and may run over into the next word.
+    """
+    bits = np.arange(BLOCK_SIZE, dtype=np.uint64) * np.uint64(width)
+    return (bits // np.uint64(64)).astype(np.int64), bits % np.uint64(64)
+
+def pack_block_deltas(deltas, widths, lengths):
+    """
+    Bit-pack blocks of deltas, every block with its own bit width.
+
+    Blocks of the same width are packed together by shifting their deltas into 64-bit
+    words, so packing needs a few word arrays the size of the blocks and no bit per bit copy.
+
+    Parameters:
+    - deltas (np.ndarray): (block count, BLOCK_SIZE) array of deltas.
+    - widths (np.ndarray): Bit width of every block.
+    - lengths (np.ndarray): Number of deltas in every block; the rest is padding and not stored.
+
+    Returns (block_offsets, packed): block b is packed[block_offsets[b]:block_offsets[b + 1]].
+    """
+    sizes = (lengths.astype(np.int64) * widths + 7) // 8
+    block_offsets = np.zeros(len(widths) + 1, dtype=np.uint64)
+    np.cumsum(sizes, out=block_offsets[1:])
+    packed = np.zeros(int(block_offsets[-1]) + _PACKED_PADDING, dtype=np.uint8)
+    for width in np.unique(widths).tolist():
+        if width == 0:
+            continue
+        blocks = np.flatnonzero(widths == width)
+        word, shift = _word_layout(width)
+        values = deltas[blocks].astype(np.uint64)
+        # Every word holds the start of at least two deltas and their bits never overlap,
+        # so or-ing the deltas that start in a word, plus the spill of the delta that ran
+        # over from the previous word, assembles it
+        first_of_word = np.searchsorted(word, np.arange(BLOCK_SIZE // 64 * width))
+        words = np.bitwise_or.reduceat(values << shift, first_of_word, axis=1)
+        spills = shift + np.uint64(width) > np.uint64(64)
+        words[:, word[spills] + 1] |= values[:, spills] >> (np.uint64(64) - shift[spills])
+        data = words.astype('<u8', copy=False).view(np.uint8)
+        keep = np.arange(data.shape[1]) < sizes[blocks][:, None]
+        starts = block_offsets[blocks].astype(np.int64)
+        packed[(starts[:, None] + np.arange(data.shape[1]))[keep]] = data[keep]
+    return block_offsets, packed
+
+def unpack_block_deltas(packed, block_offsets, widths, lengths, blocks):
+    """
+    Decode the deltas of the given blocks into a (len(blocks), BLOCK_SIZE) array, with
+    0 for the padding after a block's length. Blocks of the same bit width are unpacked together.
+    """
+    deltas = np.zeros((len(blocks), BLOCK_SIZE), dtype=np.uint64)
+    block_widths = widths[blocks]
+    for width in np.unique(block_widths).tolist():
+        if width == 0:
+            continue
+        rows = np.flatnonzero(block_widths == width)
+        starts = block_offsets[blocks[rows]].astype(np.int64)
+        words = packed[starts[:, None] + np.arange(BLOCK_SIZE // 8 * width)].view('<u8')
+        word, shift = _word_layout(width)
+        values = words[:, word] >> shift
+        spills = shift + np.uint64(width) > np.uint64(64)
+        values[:, spills] |= words[:, word[spills] + 1] << (np.uint64(64) - shift[spills])
+        deltas[rows] = values & np.uint64((1 << width) - 1)
+    deltas[np.arange(BLOCK_SIZE) >= lengths[blocks].astype(np.int64)[:, None]] = 0
+    return deltas
+
+def _cumulative(counts):
+    """
+    Return CSR offsets for the given counts: 0 followed by their running sum.
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.uint64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+def _concat_ranges(starts, lengths):
+    """
+    Return the integer ranges [starts[i], starts[i] + lengths[i]) concatenated into one array.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(int(ends[-1]) if ends.size else 0, dtype=np.int64) - np.repeat(
+        ends - lengths - np.asarray(starts, dtype=np.int64), lengths
+    )
+
+def _copy_blocks(packed, block_offsets, source, source_offsets, blocks, sizes):
+    """
+    Copy the packed bytes of the given source blocks into packed at the given blocks.
+    """
+    packed[_concat_ranges(block_offsets[blocks], sizes)] = source[_concat_ranges(source_offsets, sizes)]
+
+def ranges_mask(positions, starts, ends):
+    """
+    Return a boolean mask of which positions are inside the ranges [starts[i], ends[i]),
+    given as sorted, disjoint ranges.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(starts) == 0:
+        return np.zeros(positions.size, dtype=bool)
+    # A position can only be in the last range starting at or before it
+    ranges = np.searchsorted(starts, positions, side='right') - 1
+    return (ranges >= 0) & (positions < ends[np.maximum(ranges, 0)])
+
+class Postings:
+    """
+    Compressed CSR postings: the sorted token positions of every term, cut into blocks of
+    BLOCK_SIZE positions that are delta-encoded and bit-packed with the smallest bit width
+    that fits the block's largest gap.
+
+    - offsets: term t has offsets[t + 1] - offsets[t] positions
+    - blocks: term t owns blocks blocks[t]:blocks[t + 1]
+    - block_first: first position of every block, which doubles as its skip pointer
+    - block_widths: bit width of the deltas in every block
+    - block_lengths: number of positions in every block (BLOCK_SIZE except in a term's last block)
+    - block_offsets / packed: block b is packed[block_offsets[b]:block_offsets[b + 1]]
+
+    Frequent words have small gaps between their positions, so "ja" or "on" take a few bits
+    per occurrence instead of 32. Intersections look up block_first with a binary search
+    and decode only the blocks that can hold the positions they look for.
+    """
+
+    # Blocks delta-encoded and packed at once by encode
+    ENCODE_BATCH_BLOCKS = 4096
+
+    ARRAYS = ["offsets", "blocks", "block_first", "block_widths", "block_lengths", "block_offsets", "packed"]
+
+    def __init__(self, offsets, blocks, block_first, block_widths, block_lengths, block_offsets, packed):
+        self.offsets = offsets
+        self.blocks = blocks
+        self.block_first = block_first
+        self.block_widths = block_widths
+        self.block_lengths = block_lengths
+        self.block_offsets = block_offsets
+        self.packed = packed
+
+    @classmethod
+    def encode(cls, offsets, positions):
+        """
+        Compress CSR postings as returned by search_index.build_postings.
+
+        Blocks are delta-encoded and packed ENCODE_BATCH_BLOCKS at a time, so the working
+        memory stays a few MB beside the input and the packed output, whatever the corpus size.
+        """
+        offsets = offsets.astype(np.uint64, copy=False)
+        counts = np.diff(offsets.astype(np.int64))
+        blocks = np.zeros(len(counts) + 1, dtype=np.uint64)
+        np.cumsum((counts + BLOCK_SIZE - 1) // BLOCK_SIZE, out=blocks[1:])
+        block_count = int(blocks[-1])
+
+        # Index of the first position of every block, and the block's length
+        term_of = np.repeat(np.arange(len(counts), dtype=np.int64), np.diff(blocks.astype(np.int64)))
+        rank = np.arange(block_count, dtype=np.int64) - blocks[:-1].astype(np.int64)[term_of]
+        block_start = offsets[:-1].astype(np.int64)[term_of] + rank * BLOCK_SIZE
+        lengths = np.minimum(offsets[1:].astype(np.int64)[term_of] - block_start, BLOCK_SIZE).astype(np.uint8)
+        del term_of, rank
+
+        block_first = positions[block_start].astype(np.uint32)
+        widths = np.zeros(block_count, dtype=np.uint8)
+        block_offsets = np.zeros(block_count + 1, dtype=np.uint64)
+        chunks = []
+        for first in range(0, block_count, cls.ENCODE_BATCH_BLOCKS):
+            batch = slice(first, first + cls.ENCODE_BATCH_BLOCKS)
+            # Padding repeats the block's last position so that its deltas are 0
+            last = lengths[batch].astype(np.int64)[:, None] - 1
+            grid = positions[block_start[batch, None] + np.minimum(np.arange(BLOCK_SIZE), last)].astype(np.uint32)
+            deltas = np.zeros(grid.shape, dtype=np.uint32)
+            deltas[:, 1:] = np.diff(grid, axis=1)
+            widths[batch] = bit_widths(deltas.max(axis=1))
+            batch_offsets, packed = pack_block_deltas(deltas, widths[batch], lengths[batch])
+            block_offsets[first + 1:first + 1 + len(deltas)] = block_offsets[first] + batch_offsets[1:]
+            chunks.append(packed[:-_PACKED_PADDING])
+        chunks.append(np.zeros(_PACKED_PADDING, dtype=np.uint8))
+        return cls(offsets, blocks, block_first, widths, lengths, block_offsets, np.concatenate(chunks))
+
+    @classmethod
+    def concatenate(cls, postings):
+        """
+        Stack the terms of several postings into one, in order, without decoding any block.
+        """
+        sizes = [np.diff(p.block_offsets.astype(np.int64)) for p in postings]
+        packed = [p.packed[:int(p.block_offsets[-1])] for p in postings]
+        return cls(
+            _cumulative(np.concatenate([p.counts() for p in postings])),
+            _cumulative(np.concatenate([np.diff(p.blocks.astype(np.int64)) for p in postings])),
+            np.concatenate([p.block_first for p in postings]).astype(np.uint32, copy=False),
+            np.concatenate([p.block_widths for p in postings]).astype(np.uint8, copy=False),
+            np.concatenate([p.block_lengths for p in postings]).astype(np.uint8, copy=False),
+            _cumulative(np.concatenate(sizes)),
+            np.concatenate(packed + [np.zeros(_PACKED_PADDING, dtype=np.uint8)])
+        )
+
+    def _take_blocks(self, block_ids, block_counts):
+        """
+        Return postings made of copies of the given blocks, the next block_counts[i] of
+        them forming term i. Every block but the last one of a term must be full.
+        """
+        lengths = self.block_lengths[block_ids]
+        blocks = _cumulative(block_counts)
+        sizes = np.diff(self.block_offsets.astype(np.int64))[block_ids]
+        block_offsets = _cumulative(sizes)
+        packed = np.zeros(int(block_offsets[-1]) + _PACKED_PADDING, dtype=np.uint8)
+        _copy_blocks(packed, block_offsets, self.packed, self.block_offsets[block_ids], np.arange(len(block_ids)), sizes)
+        return Postings(
+            _cumulative(lengths.astype(np.int64))[blocks.astype(np.int64)],
+            blocks,
+            self.block_first[block_ids],
+            self.block_widths[block_ids],
+            lengths,
+            block_offsets,
+            packed
+        )
+
+    def select(self, term_ids, following=None):
+        """
+        Return postings holding only the given terms, in the given order. With following,
+        term i is followed by the positions of term following[i] (none for -1), whose
+        positions must all come later; term_ids[i] must then only have full blocks.
+        The packed blocks are copied as they are.
+        """
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        blocks = self.blocks.astype(np.int64)
+        starts = blocks[term_ids]
+        block_counts = blocks[term_ids + 1] - starts
+        if following is not None:
+            following = np.asarray(following, dtype=np.int64)
+            following_counts = np.where(following >= 0, blocks[following + 1] - blocks[following], 0)
+            starts = np.stack([starts, blocks[following]], axis=1).ravel()
+            block_ids = _concat_ranges(starts, np.stack([block_counts, following_counts], axis=1).ravel())
+            return self._take_blocks(block_ids, block_counts + following_counts)
+        return self._take_blocks(_concat_ranges(starts, block_counts), block_counts)
+
+    def head(self, term_ids, block_counts):
+        """
+        Return postings holding the first block_counts[i] blocks of every given term,
+        which must all be full.
+        """
+        return self._take_blocks(_concat_ranges(self.blocks.astype(np.int64)[term_ids], block_counts), block_counts)
+
+    def shifted(self, starts, ends, limit=None):
+        """
+        Return the postings with the sorted, disjoint token ranges [starts[i], ends[i]) cut
+        out of the position space: every position drops by the number of cut positions
+        before it. No position may lie inside a range, nor at or after limit if given.
+
+        Blocks keep their bytes and get a new first position. Only blocks that may
+        straddle a range, whose gaps shrink, are decoded and packed again.
+        """
+        ends = np.asarray(ends, dtype=np.int64)
+        removed = np.zeros(len(ends) + 1, dtype=np.int64)
+        np.cumsum(ends - np.asarray(starts, dtype=np.int64), out=removed[1:])
+
+        def removed_before(positions):
+            return removed[np.searchsorted(ends, positions, side='right')]
+
+        firsts = self.block_first.astype(np.int64)
+        shifts = removed_before(firsts)
+        # A block ends before the next block of its term starts; a term's last block may run
+        # up to the limit
+        last_shift = removed[-1] if limit is None else removed_before(limit - 1)
+        next_shifts = np.append(shifts[1:], last_shift)
+        blocks = self.blocks.astype(np.int64)
+        next_shifts[blocks[1:][blocks[1:] > blocks[:-1]] - 1] = last_shift
+        repacked = np.flatnonzero(shifts != next_shifts)
+
+        widths = self.block_widths.copy()
+        sizes = np.diff(self.block_offsets.astype(np.int64))
+        chunks = []
+        chunk_offsets = []
+        total = 0
+        for first in range(0, len(repacked), self.ENCODE_BATCH_BLOCKS):
+            batch = repacked[first:first + self.ENCODE_BATCH_BLOCKS]
+            # Padding repeats the block's last position, so its deltas stay 0
+            grid = self.decode_blocks(batch)
+            grid -= removed_before(grid)
+            deltas = np.zeros(grid.shape, dtype=np.uint32)
+            deltas[:, 1:] = np.diff(grid, axis=1)
+            widths[batch] = bit_widths(deltas.max(axis=1))
+            batch_offsets, packed = pack_block_deltas(deltas, widths[batch], self.block_lengths[batch])
+            sizes[batch] = np.diff(batch_offsets.astype(np.int64))
+            chunks.append(packed[:-_PACKED_PADDING])
+            chunk_offsets.append(batch_offsets[:-1].astype(np.int64) + total)
+            total += int(batch_offsets[-1])
+
+        block_offsets = _cumulative(sizes)
+        packed = np.zeros(int(block_offsets[-1]) + _PACKED_PADDING, dtype=np.uint8)
+        kept = np.ones(len(sizes), dtype=bool)
+        kept[repacked] = False
+        kept = np.flatnonzero(kept)
+        _copy_blocks(packed, block_offsets, self.packed, self.block_offsets[kept], kept, sizes[kept])
+        if chunks:
+            _copy_blocks(packed, block_offsets, np.concatenate(chunks), np.concatenate(chunk_offsets), repacked, sizes[repacked])
+        return Postings(
+            self.offsets.copy(),
+            self.blocks.copy(),
+            (firsts - shifts).astype(np.uint32),
+            widths,
+            self.block_lengths.copy(),
+            block_offsets,
+            packed
+        )
+
+    def decode_terms(self, term_ids, skip_blocks=0):
+        """
+        Decode the positions of the given terms into CSR arrays (offsets, positions), in
+        the given order, leaving out the first skip_blocks blocks of every term.
+        """
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        blocks = self.blocks.astype(np.int64)
+        starts = blocks[term_ids] + skip_blocks
+        block_counts = blocks[term_ids + 1] - starts
+        block_ids = _concat_ranges(starts, block_counts)
+        positions = [np.zeros(0, dtype=np.int64)]
+        for first in range(0, len(block_ids), self.ENCODE_BATCH_BLOCKS):
+            batch = block_ids[first:first + self.ENCODE_BATCH_BLOCKS]
+            valid = np.arange(BLOCK_SIZE) < self.block_lengths[batch].astype(np.int64)[:, None]
+            positions.append(self.decode_blocks(batch)[valid])
+        lengths = _cumulative(self.block_lengths[block_ids].astype(np.int64))
+        return lengths[_cumulative(block_counts).astype(np.int64)], np.concatenate(positions)
+
+    def arrays(self, prefix):
+        """
+        Return the arrays of the postings for write_store, named with the prefix.
+        """
+        return {f"{prefix}{name}": getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """
+        Open postings written with arrays(prefix) from a store's arrays, without decoding.
+        """
+        return cls(*(arrays[f"{prefix}{name}"] for name in cls.ARRAYS))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def counts(self):
+        """
+        Return the number of positions of every term.
+        """
+        return np.diff(self.offsets.astype(np.int64))
+
+    def count(self, term_id):
+        return int(self.offsets[term_id + 1]) - int(self.offsets[term_id])
+
+    def decode_blocks(self, blocks):
+        """
+        Decode whole blocks into a (len(blocks), BLOCK_SIZE) array of positions.
+        """
+        deltas = unpack_block_deltas(self.packed, self.block_offsets, self.block_widths, self.block_lengths, blocks)
+        return self.block_first[blocks].astype(np.int64)[:, None] + np.cumsum(deltas, axis=1).astype(np.int64)
+
+    def positions(self, term_id, limit=None):
+        """
+        Return the sorted token positions of a term, or only its first limit positions.
+        Only the blocks that hold them are decoded.
+        """
+        count = self.count(term_id)
+        if limit is not None:
+            count = min(count, limit)
+        first_block = int(self.blocks[term_id])
+        blocks = np.arange(first_block, first_block + (count + BLOCK_SIZE - 1) // BLOCK_SIZE)
+        return self.decode_blocks(blocks).ravel()[:count]
+
+    def positions_in(self, term_id, starts, ends):
+        """
+        Return the sorted token positions of a term inside the sorted, disjoint ranges
+        [starts[i], ends[i]). Only the blocks that overlap a range are decoded.
+        """
+        first_block, end_block = int(self.blocks[term_id]), int(self.blocks[term_id + 1])
+        firsts = self.block_first[first_block:end_block].astype(np.int64)
+        if firsts.size == 0 or len(starts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        # A block holds positions from its first one up to the next block's first one, and
+        # overlaps a range when the first range ending after its first position starts before that
+        following = np.searchsorted(ends, firsts, side='right')
+        next_firsts = np.append(firsts[1:], np.iinfo(np.int64).max)
+        overlaps = following < len(starts)
+        overlaps[overlaps] = starts[following[overlaps]] < next_firsts[overlaps]
+        blocks = np.flatnonzero(overlaps) + first_block
+        valid = np.arange(BLOCK_SIZE) < self.block_lengths[blocks].astype(np.int64)[:, None]
+        positions = self.decode_blocks(blocks)[valid]
+        return positions[ranges_mask(positions, starts, ends)]
+
+    def contains(self, term_id, wanted):
+        """
+        Return a boolean mask of which sorted positions in wanted occur in the term's postings.
+
+        The skip pointers locate the one block each wanted position could be in, and only
+        those blocks are decoded, so a rare word intersected with a frequent one touches a
+        handful of the frequent word's blocks.
+        """
+        found = np.zeros(len(wanted), dtype=bool)
+        first_block, end_block = int(self.blocks[term_id]), int(self.blocks[term_id + 1])
+        if first_block == end_block or len(wanted) == 0:
+            return found
+        if len(wanted) >= end_block - first_block:
+            # Most blocks would be touched anyway: decode them all and skip the bookkeeping
+            positions = self.positions(term_id)
+            slots = np.minimum(np.searchsorted(positions, wanted), positions.size - 1)
+            return positions[slots] == wanted
+        block_of = np.searchsorted(self.block_first[first_block:end_block], wanted, side='right') - 1
+        candidates = block_of >= 0
+        blocks, rows = np.unique(block_of[candidates], return_inverse=True)
+        if blocks.size == 0:
+            return found
+        # Padding decodes as repeats of a block's last position, so it never adds a position
+        decoded = self.decode_blocks(blocks + first_block)
+        # Rows are sorted and positions fit in 32 bits, so keying every position by its row
+        # makes the decoded blocks one sorted array that a single searchsorted can probe
+        keys = (np.arange(len(blocks), dtype=np.int64)[:, None] << 32) + decoded
+        wanted_keys = (rows.astype(np.int64) << 32) + np.asarray(wanted, dtype=np.int64)[candidates]
+        slots = np.minimum(np.searchsorted(keys.ravel(), wanted_keys), keys.size - 1)
+        found[candidates] = keys.ravel()[slots] == wanted_keys
+        return found
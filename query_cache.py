@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_FOLDER = "cache"
+SIGNATURE_FILE = "signature.txt"
+
+def file_signature(path):
+    """
+    Signature of a single file (such as the index) from its size and modification time.
+    Returns None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+
+def folder_signature(folder, extension='.json'):
+    """
+    Signature of the transcript corpus from the name, size and modification time of every
+    transcript file. Costs one stat per file, never reads the files.
+    """
+    digest = hashlib.sha1(os.path.abspath(folder).encode('utf-8'))
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if entry.name.endswith(extension):
+            stat = entry.stat()
+            digest.update(f"\0{entry.name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()
+
+def cache_key(**params):
+    """
+    Stable key for a query: the SHA-1 of its parameters as sorted JSON.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class QueryCache:
+    """
+    Two-level LRU cache of search results: a small in-memory level in front of one JSON
+    file per entry in the cache folder.
+
+    The cache belongs to one corpus signature. Opening it with a different signature than
+    the one recorded in the folder discards every entry, so results never outlive the
+    transcripts or index they were computed from. A cache that stays open, like the one of
+    a search server, checks the recorded signature again before it touches an entry on
+    disk; once another process has taken the folder over for a newer signature, it keeps
+    its results in memory only. Both levels evict their least recently
+    used entries beyond their size limits; on disk, file modification times record use.
+    Both levels are bounded by entry count and by the total bytes of their entries' JSON,
+    and a value whose JSON exceeds max_entry_bytes (such as every match of a common word)
+    is not cached at all.
+    """
+
+    def __init__(
+        self,
+        folder,
+        signature,
+        memory_entries=256,
+        disk_entries=4096,
+        memory_bytes=64 * 1024 * 1024,
+        disk_bytes=256 * 1024 * 1024,
+        max_entry_bytes=4 * 1024 * 1024
+    ):
+        self.folder = folder
+        self.signature = signature
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # (value, JSON size) of the keys in memory, least recently used first
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        signature_path = os.path.join(folder, SIGNATURE_FILE)
+        try:
+            with open(signature_path, 'r', encoding='utf-8') as f:
+                valid = f.read().strip() == signature
+        except FileNotFoundError:
+            valid = False
+
+        entries = []
+        for entry in os.scandir(folder):
+            if not entry.name.endswith('.json'):
+                continue
+            if valid:
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, entry.name[:-5], stat.st_size))
+            else:
+                os.remove(entry.path)
+        # Sizes of the keys on disk, least recently used first
+        self.disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.disk_size = sum(self.disk.values())
+
+        if not valid:
+            with open(signature_path, 'w', encoding='utf-8') as f:
+                f.write(signature)
+
+    def entry_path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def owns_folder(self):
+        """
+        Return whether the folder still records this cache's signature.
+        """
+        try:
+            with open(os.path.join(self.folder, SIGNATURE_FILE), 'r', encoding='utf-8') as f:
+                return f.read().strip() == self.signature
+        except FileNotFoundError:
+            return False
+
+    def get(self, key):
+        """
+        Return the cached value for the key, or None.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key][0]
+            if key not in self.disk:
+                return None
+            if not self.owns_folder():
+                self.disk_size -= self.disk.pop(key)
+                return None
+            try:
+                with open(self.entry_path(key), 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+                os.utime(self.entry_path(key))
+            except (FileNotFoundError, json.JSONDecodeError):
+                # Evicted or being written by another process
+                self.disk_size -= self.disk.pop(key)
+                return None
+            self.disk.move_to_end(key)
+            self.remember(key, value, self.disk[key])
+            return value
+
+    def put(self, key, value):
+        """
+        Store a JSON-serializable value in both levels, unless it is larger than max_entry_bytes.
+        """
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        if len(data) > self.max_entry_bytes:
+            return
+        with self.lock:
+            self.remember(key, value, len(data))
+            if not self.owns_folder():
+                return
+            tmp_path = self.entry_path(key) + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.entry_path(key))
+            self.disk_size += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            while len(self.disk) > self.disk_entries or self.disk_size > self.disk_bytes:
+                evicted, size = self.disk.popitem(last=False)
+                self.disk_size -= size
+                try:
+                    os.remove(self.entry_path(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def remember(self, key, value, size):
+        """
+        Insert into the in-memory level, evicting its least recently used entries when full.
+        """
+        if key in self.memory:
+            self.memory_size -= self.memory.pop(key)[1]
+        self.memory[key] = (value, size)
+        self.memory_size += size
+        while len(self.memory) > self.memory_entries or self.memory_size > self.memory_bytes:
+            self.memory_size -= self.memory.popitem(last=False)[1][1]
@@ -1,9 +1,50 @@
 import os
-import json
 import sys
+import csv
+import time
+import json
+import atexit
+import heapq
+import argparse
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from rapidfuzz import fuzz
 from tqdm import tqdm
+from transcripts import (
+    SearchFilter,
+    extract_video_info,
+    in_date_range,
+    in_time_window,
+    list_transcripts,
+    join_words,
+    parse_date,
+    plan_chunks,
+    read_transcript_words
+)
+from transcript_store import TranscriptStore, seconds_to_ms
+from query_cache import CACHE_FOLDER, QueryCache, cache_key, file_signature, folder_signature
+from search_index import (
+    INDEX_FOLDER,
+    INDEX_FILE,
+    PATTERN_ENGINES,
+    build_index,
+    FileTermIndex,
+    PrefixIndex,
+    TranscriptIndex
+)
+
+# Memory-mapped store opened once per worker process by init_store_worker.
+# All workers map the same file, so the corpus lives once in the page cache.
+_worker_store = None
+
+# Process pools kept alive between searches in the same process, keyed by their configuration
+_pools = {}
+
+# Unique sequence numbers so heap entries with equal similarity never compare their dicts
+_heap_sequence = itertools.count()
 
 def format_time(seconds):
     """
@@ -14,69 +55,170 @@ def format_time(seconds):
     secs = int(seconds % 60)
     return f"{hours:02}:{minutes:02}:{secs:02}"
 
-def extract_video_info(filename):
+def parse_time(text):
     """
-    Extract youtube_id and video_name from the filename.
-    Expected filename formats:
-    - unixtimestamp_uploaddate_videoid_videoname.json
-    - unixtimestamp_uploaddate__videoid_videoname.json (double underscore variant)
-    Example: 1222079676_20080922_PLHlE5YN3LE_Joulua Odotellessa.json
+    Parse an in-video time given as seconds, MM:SS or HH:MM:SS into milliseconds.
+    Raises ValueError for anything else.
     """
-    basename = os.path.splitext(filename)[0]  # Remove .json extension
-    parts = basename.split('_')
+    seconds = 0.0
+    try:
+        for part in text.strip().split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise ValueError(f"Invalid time '{text}', expected seconds, MM:SS or HH:MM:SS.") from None
+    return seconds_to_ms(seconds)
 
-    # Handle both single and double underscore between date and videoid
-    # After splitting, an empty string appears where there were consecutive underscores
-    if len(parts) < 4:
-        return None, None  # Invalid format
+def build_search_filter(from_date=None, to_date=None, start_time=None, end_time=None):
+    """
+    Build a SearchFilter from user input, or return None if no filter is set.
 
-    # Filter out empty strings from double underscores
-    parts = [p for p in parts if p]
+    Parameters:
+    - from_date (str): Earliest upload date, YYYY, YYYY-MM or YYYY-MM-DD (inclusive).
+    - to_date (str): Latest upload date, YYYY, YYYY-MM or YYYY-MM-DD (inclusive).
+    - start_time (str): Only words starting at or after this time in each video.
+    - end_time (str): Only words starting before this time in each video.
+
+    Raises ValueError for invalid dates or times.
+    """
+    if from_date is None and to_date is None and start_time is None and end_time is None:
+        return None
+    return SearchFilter(
+        parse_date(from_date) if from_date is not None else None,
+        parse_date(to_date, end=True) if to_date is not None else None,
+        parse_time(start_time) if start_time is not None else None,
+        parse_time(end_time) if end_time is not None else None
+    )
 
-    if len(parts) < 3:
-        return None, None  # Invalid format after filtering
+def push_top_k(heap, matches, top_k):
+    """
+    Push matches into a bounded min-heap that keeps the top_k best matches by similarity.
+    With top_k 0 or less the heap stays empty.
+    """
+    if top_k <= 0:
+        return
+    for match in matches:
+        entry = (match["similarity"], next(_heap_sequence), match)
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
 
-    youtube_id = parts[2]
-    video_name = '_'.join(parts[3:]) if len(parts) > 3 else ''  # In case video name contains underscores
-    return youtube_id, video_name
+def sorted_top_k(heap):
+    """
+    Return the matches of a top_k heap, best first.
+    """
+    return [match for _, _, match in sorted(heap, key=lambda entry: (-entry[0], entry[1]))]
 
-def process_file(json_file, output_folder, search_word, threshold):
+def process_file(json_file, output_folder, search_word, threshold, top_k=None, search_filter=None, context=0):
     """
     Worker function to process a single JSON file and search for matches.
-    Returns a list of matches found in this file.
+    Returns a list of matches found in this file, or only its top_k best matches.
+    Words outside the search_filter's time window are skipped before scoring.
+    With context, every match gets the text of that many words on either side of it.
     """
     matches = []
+    top_k_heap = []
     json_path = os.path.join(output_folder, json_file)
     youtube_id, video_name = extract_video_info(json_file)
 
     if not youtube_id or not video_name:
         return matches  # Return empty list for invalid format
 
-    # Load JSON data
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
+    # Load JSON data as word, start and end columns
+    transcript = read_transcript_words(json_path)
+    if transcript is None:
         return matches  # Return empty list for invalid JSON
 
     # Iterate over words and perform fuzzy matching
-    for word_entry in data.get('words', []):
-        word = word_entry.get('word', '')
-        similarity = fuzz.ratio(search_word.lower(), word.lower())
+    query = search_word.lower()
+    for position, (word, start, end) in enumerate(zip(transcript.words, transcript.starts, transcript.ends)):
+        if search_filter is not None and not in_time_window(seconds_to_ms(start), search_filter):
+            continue
+        similarity = fuzz.ratio(query, word.lower())
         if similarity >= threshold:
             match_info = {
                 "video_id": youtube_id,
                 "video_name": video_name,
                 "matched_word": word,
-                "start_time": word_entry.get('start', 0),
-                "end_time": word_entry.get('end', 0),
+                "start_time": start,
+                "end_time": end,
                 "similarity": similarity
             }
-            matches.append(match_info)
+            if context:
+                match_info["context"] = join_words(transcript.words[max(0, position - context):position + context + 1])
+            if top_k is not None:
+                push_top_k(top_k_heap, [match_info], top_k)
+            else:
+                matches.append(match_info)
 
+    if top_k is not None:
+        return sorted_top_k(top_k_heap)
     return matches
 
-def search_word_in_transcriptions(search_word, output_folder='output', threshold=80, max_workers=None):
+def process_files(json_files, output_folder, search_word, threshold, top_k=None, search_filter=None, context=0):
+    """
+    Worker function to process a chunk of JSON files in one task.
+    Returns the matches of all files, or only the top_k best of them.
+    """
+    if top_k is None:
+        matches = []
+        for json_file in json_files:
+            matches.extend(process_file(json_file, output_folder, search_word, threshold, None, search_filter, context))
+        return matches
+
+    top_k_heap = []
+    for json_file in json_files:
+        matches = process_file(json_file, output_folder, search_word, threshold, top_k, search_filter, context)
+        push_top_k(top_k_heap, matches, top_k)
+    return sorted_top_k(top_k_heap)
+
+def chunk_files(json_files, output_folder, worker_count):
+    """
+    Group files into size-weighted chunks, largest transcripts first (see plan_chunks).
+    """
+    sizes = [os.path.getsize(os.path.join(output_folder, json_file)) for json_file in json_files]
+    return plan_chunks(json_files, sizes, worker_count)
+
+def get_pool(max_workers=None, initializer=None, initargs=()):
+    """
+    Return a process pool that stays alive for later searches in the same process.
+    Pools are reused when asked for again with the same configuration.
+
+    A pool whose initializer got the same first argument (the store path of init_store_worker)
+    but different other arguments (an older mtime) serves a file that has since been
+    replaced, so it is shut down when its replacement is created.
+    """
+    key = (max_workers or os.cpu_count(), initializer, initargs)
+    pool = _pools.get(key)
+    if pool is None:
+        if initializer is not None and initargs:
+            stale = [other for other in _pools if other[1] is initializer and other[2][:1] == initargs[:1]]
+            for other in stale:
+                _pools.pop(other).shutdown(wait=False, cancel_futures=True)
+        pool = ProcessPoolExecutor(max_workers=key[0], initializer=initializer, initargs=initargs)
+        _pools[key] = pool
+    return pool
+
+@atexit.register
+def shutdown_pools():
+    """
+    Shut down every persistent process pool.
+    """
+    for pool in _pools.values():
+        pool.shutdown(cancel_futures=True)
+    _pools.clear()
+
+def search_word_in_transcriptions(
+    search_word,
+    output_folder='output',
+    threshold=80,
+    max_workers=None,
+    top_k=None,
+    writer=None,
+    search_filter=None,
+    index_folder=INDEX_FOLDER,
+    context=0
+):
     """
     Search for a single word with fuzzy matching in all transcription JSON files using multiprocessing.
 
@@ -85,12 +227,22 @@ def search_word_in_transcriptions(search_word, output_folder='output', threshold
     - output_folder (str): Path to the folder containing transcription JSON files.
     - threshold (int): The minimum similarity score (0-100) to consider a match.
     - max_workers (int): Number of worker processes. None defaults to CPU core count.
+    - top_k (int): Only keep the top_k best matches by similarity. Each worker returns at most
+      top_k matches and the parent merges them into one bounded heap.
+    - writer (MatchWriter): Stream each file's matches as soon as its worker finishes
+      instead of collecting them all. Top-k results can only be written at the end.
+    - search_filter (SearchFilter): Only read files uploaded inside its date range and only
+      score words inside its time window.
+    - index_folder (str): Folder with the file pruning sidecar written by 'python search.py index'.
+      Without it every file is scanned.
+    - context (int): Add the text of that many words on either side of every match.
     """
     all_matches = []
+    top_k_heap = []
 
     # List all JSON files in the output folder
     try:
-        json_files = [f for f in os.listdir(output_folder) if f.endswith('.json')]
+        json_files = list_transcripts(output_folder)
     except FileNotFoundError:
         print(f"Error: The folder '{output_folder}' does not exist.")
         sys.exit(1)
@@ -99,34 +251,294 @@ def search_word_in_transcriptions(search_word, output_folder='output', threshold
         print(f"No JSON transcription files found in '{output_folder}'.")
         sys.exit(1)
 
-    print(f"Searching for the word: '{search_word}' using multiprocessing")
-    print(f"Processing {len(json_files)} files with {max_workers or os.cpu_count()} worker processes...\n")
-
-    # Use ProcessPoolExecutor for true parallelism
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks and create a dictionary mapping futures to filenames
-        future_to_file = {
-            executor.submit(process_file, json_file, output_folder, search_word, threshold): json_file
-            for json_file in json_files
-        }
-
-        # Process completed tasks with progress bar
-        with tqdm(total=len(json_files), desc="Searching", unit="file") as pbar:
-            for future in as_completed(future_to_file):
-                json_file = future_to_file[future]
-                try:
-                    matches = future.result()
-                    if matches:
-                        all_matches.extend(matches)
-                except Exception as exc:
-                    print(f"\nWarning: Error processing '{json_file}': {exc}")
-                finally:
-                    pbar.update(1)
-
-    # Display results
-    if all_matches:
-        print(f"\nFound {len(all_matches)} match{'es' if len(all_matches) !=1 else ''}:\n")
-        for match in all_matches:
+    if search_filter is not None:
+        # Files outside the date range are never opened
+        json_files = [json_file for json_file in json_files if in_date_range(json_file, search_filter)]
+
+    log(f"Searching for the word: '{search_word}' using multiprocessing", writer)
+
+    # Skip the files that the sidecar proves cannot contain a match
+    file_terms = FileTermIndex.load(index_folder)
+    if file_terms is not None:
+        file_count = len(json_files)
+        json_files = file_terms.prune(json_files, output_folder, search_word, threshold)
+        file_terms.close()
+        log(f"Pruned {file_count - len(json_files)} of {file_count} files that cannot contain a match.", writer)
+
+    workers = max_workers or os.cpu_count()
+    chunks = chunk_files(json_files, output_folder, workers)
+    log(f"Processing {len(json_files)} files in {len(chunks)} chunks with {workers} worker processes...\n", writer)
+
+    # Reuse a persistent pool and submit largest-first chunks instead of one task per file
+    executor = get_pool(workers)
+    future_to_chunk = {
+        executor.submit(process_files, chunk, output_folder, search_word, threshold, top_k, search_filter, context): chunk
+        for chunk in chunks
+    }
+
+    # Process completed tasks with progress bar
+    with tqdm(total=len(json_files), desc="Searching", unit="file") as pbar:
+        for future in as_completed(future_to_chunk):
+            chunk = future_to_chunk[future]
+            try:
+                matches = future.result()
+                if matches and top_k is not None:
+                    push_top_k(top_k_heap, matches, top_k)
+                elif matches and writer is not None:
+                    writer.write(matches)
+                elif matches:
+                    all_matches.extend(matches)
+            except Exception as exc:
+                log(f"\nWarning: Error processing {len(chunk)} files starting with '{chunk[0]}': {exc}", writer)
+            finally:
+                pbar.update(len(chunk))
+
+    if top_k is not None:
+        all_matches = sorted_top_k(top_k_heap)
+    emit_matches(all_matches, writer)
+    return all_matches
+
+def init_store_worker(store_path, store_version=None):
+    """
+    Pool initializer: map the transcript store into the worker process.
+    store_version only distinguishes pools created for different builds of the same file.
+    """
+    global _worker_store
+    _worker_store = TranscriptStore(store_path)
+
+def scan_store_ranges(ranges, search_word, threshold, top_k=None):
+    """
+    Worker function to fuzzy match the token position ranges (start, end) of the shared store.
+
+    Each distinct token in the ranges is scored once, then the matching tokens are located
+    with a vectorized scan of the token id array. Returns (positions, similarities) as NumPy
+    arrays so only the hits travel back to the parent, never match_info dicts.
+    With top_k, tokens are located best score first and at most top_k hits are returned.
+    """
+    token_positions = np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in ranges])
+    tokens = _worker_store.token_ids[token_positions]
+    query = search_word.lower()
+    matched_ids = []
+    matched_scores = []
+    for token_id in np.unique(tokens).tolist():
+        similarity = fuzz.ratio(query, _worker_store.word(token_id).lower())
+        if similarity >= threshold:
+            matched_ids.append(token_id)
+            matched_scores.append(similarity)
+
+    if not matched_ids:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float64)
+
+    if top_k is not None:
+        positions = []
+        similarities = []
+        for similarity, token_id in sorted(zip(matched_scores, matched_ids), key=lambda pair: -pair[0]):
+            hits = np.flatnonzero(tokens == token_id)[:top_k - len(positions)]
+            positions.extend(token_positions[hits].tolist())
+            similarities.extend([similarity] * len(hits))
+            if len(positions) >= top_k:
+                break
+        return np.array(positions, dtype=np.uint32), np.array(similarities)
+
+    matched_ids = np.array(matched_ids, dtype=np.uint32)
+    hits = np.flatnonzero(np.isin(tokens, matched_ids))
+    similarities = np.array(matched_scores)[np.searchsorted(matched_ids, tokens[hits])]
+    return token_positions[hits].astype(np.uint32), similarities
+
+def split_store_ranges(ranges, worker_count):
+    """
+    Group token ranges (start, end) into word-count weighted chunks, longest first
+    (see plan_chunks).
+    """
+    return plan_chunks(ranges, [end - start for start, end in ranges], worker_count)
+
+def search_word_in_store(
+    search_word,
+    index_folder=INDEX_FOLDER,
+    threshold=80,
+    max_workers=None,
+    top_k=None,
+    writer=None,
+    search_filter=None,
+    context=0
+):
+    """
+    Fuzzy search by scanning the memory-mapped store with a process pool.
+
+    Workers map the index file instead of parsing JSON, so resident memory stays roughly
+    flat as max_workers grows. Returns the same matches as search_word_in_transcriptions,
+    or only the top_k best ones. With a writer, each chunk's matches are streamed as it completes.
+    With a search_filter, only the token ranges inside its date range and time window are scanned.
+    With context, matches get the text of that many words on either side, sliced from the store.
+    """
+    index = load_index_or_exit(index_folder)
+    if context:
+        index = index.with_context(context)
+
+    workers = max_workers or os.cpu_count()
+    ranges = index.store.window_ranges(search_filter)
+    chunks = split_store_ranges(ranges, workers)
+    log(f"Searching for the word: '{search_word}' in the shared store", writer)
+    log(f"Scanning {sum(end - start for start, end in ranges)} words in {len(chunks)} chunks with {workers} worker processes...\n", writer)
+
+    all_matches = []
+    best_positions = np.zeros(0, dtype=np.uint32)
+    best_similarities = np.zeros(0)
+    store_path = os.path.join(index_folder, INDEX_FILE)
+    # The mtime is part of the pool key, so a rebuilt index gets workers that map the new file
+    executor = get_pool(workers, init_store_worker, (store_path, os.stat(store_path).st_mtime_ns))
+    futures = [executor.submit(scan_store_ranges, chunk, search_word, threshold, top_k) for chunk in chunks]
+    with tqdm(total=len(futures), desc="Searching", unit="chunk") as pbar:
+        for future in as_completed(futures):
+            positions, similarities = future.result()
+            if top_k is not None:
+                # Keep only the top_k hits seen so far
+                best_positions = np.concatenate((best_positions, positions))
+                best_similarities = np.concatenate((best_similarities, similarities))
+                best = np.argsort(-best_similarities, kind='stable')[:top_k]
+                best_positions, best_similarities = best_positions[best], best_similarities[best]
+            elif writer is not None:
+                writer.write(index.positions_to_matches(positions, similarities.tolist()))
+            else:
+                all_matches.extend(index.positions_to_matches(positions, similarities.tolist()))
+            pbar.update(1)
+
+    if top_k is not None:
+        all_matches = index.positions_to_matches(best_positions, best_similarities.tolist())
+
+    emit_matches(all_matches, writer)
+    return all_matches
+
+class MatchWriter:
+    """
+    Streams match_info dicts as JSON lines or CSV rows. Every write is flushed so
+    downstream tools can consume hits while the search is still running.
+    """
+
+    FIELDS = ["video_id", "video_name", "matched_word", "start_time", "end_time", "similarity"]
+    RANKED_FIELDS = ["rank", "score"] + FIELDS
+
+    def __init__(self, out, output_format="jsonl", fields=None):
+        self.out = out
+        self.output_format = output_format
+        self.count = 0
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(out, fieldnames=fields or self.FIELDS, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+    def write(self, matches):
+        if self.output_format == "csv":
+            self.csv_writer.writerows(matches)
+        else:
+            for match in matches:
+                self.out.write(json.dumps(match, ensure_ascii=False) + "\n")
+        self.out.flush()
+        self.count += len(matches)
+
+def log(message, writer=None):
+    """
+    Print a status message. While matches are streamed, status goes to stderr so
+    the match output stays machine-readable.
+    """
+    print(message, file=sys.stderr if writer is not None else sys.stdout)
+
+def search_cache_key(
+    search_word,
+    exact=False,
+    engine="scan",
+    threshold=80,
+    max_distance=2,
+    top_k=None,
+    search_filter=None,
+    snippets=None,
+    context=0
+):
+    """
+    Cache key of a search, or of a BM25 ranking when snippets is set. Parameters that
+    cannot change the result (the threshold of exact and phrase searches, the edit distance
+    outside 'symspell') are left out, so equivalent searches share one entry.
+    Regex and glob patterns keep their case, since escapes like \W and \w differ.
+    """
+    words = search_word.split()
+    if len(words) > 1 and snippets is None and (exact or engine not in PATTERN_ENGINES):
+        mode = "phrase"
+    elif exact:
+        mode = "exact"
+    else:
+        mode = engine
+    return cache_key(
+        query=" ".join(
+            word if word.startswith("NEAR/") or mode in PATTERN_ENGINES else word.lower()
+            for word in words
+        ),
+        mode=mode,
+        threshold=threshold if mode not in ("phrase", "exact", "stem") + PATTERN_ENGINES else None,
+        max_distance=max_distance if mode == "symspell" else None,
+        top_k=top_k,
+        search_filter=list(search_filter) if search_filter is not None else None,
+        snippets=snippets,
+        context=context
+    )
+
+def open_query_cache(scan, output_folder='output', index_folder=INDEX_FOLDER):
+    """
+    Open the result cache for searches that read the transcript files (scan=True) or the index.
+    Each has its own cache folder, invalidated when the transcripts or the index change.
+    Returns None if there is nothing to compute a signature from, or no index folder to
+    keep the cache in; the cache never creates the index folder itself.
+    """
+    if not os.path.isdir(index_folder):
+        return None
+    try:
+        signature = folder_signature(output_folder) if scan else file_signature(os.path.join(index_folder, INDEX_FILE))
+    except FileNotFoundError:
+        return None
+    if signature is None:
+        return None
+    return QueryCache(os.path.join(index_folder, CACHE_FOLDER, "scan" if scan else "index"), signature)
+
+def emit_matches(matches, writer=None):
+    """
+    Print matches for a human, or stream them through the writer.
+    """
+    if writer is None:
+        print_matches(matches)
+    else:
+        writer.write(matches)
+
+def emit_ranked(results, writer=None):
+    """
+    Print ranked videos for a human, or stream their matches through the writer with
+    the video's rank and score added to every match.
+    """
+    if writer is not None:
+        for result in results:
+            writer.write([dict(match, rank=result["rank"], score=result["score"]) for match in result["matches"]])
+        return
+    if not results:
+        print("No matching videos found.")
+        return
+    print(f"\nTop {len(results)} video{'s' if len(results) != 1 else ''}:\n")
+    for result in results:
+        print(f"{result['rank']}. {result['video_name']} (score {result['score']:.4f}, {result['hits']} hits)")
+        print(f"   https://www.youtube.com/watch?v={result['video_id']}")
+        for match in result["matches"]:
+            print(
+                f"   {format_time(match['start_time'])}  {match['matched_word']} "
+                f"({match['similarity']:.1f}%)  "
+                f"https://www.youtube.com/watch?v={match['video_id']}&t={int(match['start_time'])}"
+            )
+            if "context" in match:
+                print(f"      ...{match['context']}...")
+        print("-" * 50)
+
+def print_matches(matches):
+    """
+    Print match_info dicts in a human-readable block.
+    """
+    if matches:
+        print(f"\nFound {len(matches)} match{'es' if len(matches) !=1 else ''}:\n")
+        for match in matches:
             start_formatted = format_time(match['start_time'])
             end_formatted = format_time(match['end_time'])
             youtube_link = f"https://www.youtube.com/watch?v={match['video_id']}&t={int(match['start_time'])}"
@@ -134,14 +546,447 @@ def search_word_in_transcriptions(search_word, output_folder='output', threshold
             print(f"Video Name: {match['video_name']}")
             print(f"Matched Word: {match['matched_word']} (Similarity: {match['similarity']}%)")
             print(f"Timestamp: {start_formatted} - {end_formatted}")
+            if "context" in match:
+                print(f"Context: {match['context']}")
             print(f"Link: {youtube_link}")
             print("-" * 50)
     else:
         print("\nNo matches found.")
 
-def main():
+def load_index_or_exit(index_folder=INDEX_FOLDER):
     """
-    Main function to execute the search.
+    Load the index, or exit with a hint to build it first.
+    """
+    try:
+        return TranscriptIndex.load(index_folder)
+    except FileNotFoundError:
+        print(f"Error: No index found in '{index_folder}'. Build it first with 'python search.py index'.")
+        sys.exit(1)
+
+def run_index_search(
+    index,
+    search_word,
+    exact=False,
+    threshold=80,
+    engine="vocab",
+    max_distance=2,
+    top_k=None,
+    search_filter=None,
+    context=0
+):
+    """
+    Run a search against a loaded index with the chosen engine.
+    Queries with several words run as phrase or NEAR/k proximity searches, except with the
+    'regex' and 'glob' engines, where the whole query is one pattern.
+    With a search_filter, only the occurrences inside it are turned into matches.
+    With context, matches get the text of that many words on either side.
+    """
+    if search_filter is not None:
+        index = index.filtered(search_filter)
+    if context:
+        index = index.with_context(context)
+    if engine in PATTERN_ENGINES and not exact:
+        return index.pattern_search(search_word, engine == "glob", top_k)
+    if len(search_word.split()) > 1:
+        return index.phrase_search(search_word, top_k)
+    if exact:
+        return index.exact_search(search_word, top_k)
+    if engine == "symspell":
+        return index.symspell_search(search_word, threshold, max_distance, top_k)
+    if engine == "bktree":
+        return index.bktree_search(search_word, threshold, top_k)
+    if engine == "stem":
+        return index.stem_search(search_word, top_k)
+    return index.fuzzy_search(search_word, threshold, top_k)
+
+def run_index_rank(
+    index,
+    query,
+    exact=False,
+    threshold=80,
+    engine="vocab",
+    max_distance=2,
+    limit=10,
+    snippets=3,
+    search_filter=None,
+    context=0
+):
+    """
+    Rank videos by BM25 against a loaded index, counting only the occurrences inside the search_filter.
+    Multi-word queries are scored as a bag of words. With context, snippets get the
+    text of that many words on either side.
+    """
+    if search_filter is not None:
+        index = index.filtered(search_filter)
+    if context:
+        index = index.with_context(context)
+    return index.rank_videos(query, exact, threshold, engine, max_distance, limit, snippets)
+
+def rank_videos_in_index(
+    query,
+    index_folder=INDEX_FOLDER,
+    exact=False,
+    threshold=80,
+    engine="vocab",
+    max_distance=2,
+    limit=10,
+    snippets=3,
+    writer=None,
+    search_filter=None,
+    context=0
+):
+    """
+    Rank videos by BM25 relevance to the query and show their best hits.
+
+    Parameters:
+    - query (str): One or more words.
+    - index_folder (str): Path to the folder containing the index.
+    - exact (bool): Match the words exactly, ignoring case and surrounding punctuation.
+    - threshold (int): The minimum similarity score (0-100) for fuzzy matching.
+    - engine (str): How words are matched: 'vocab', 'symspell', 'bktree', 'stem', 'regex' or 'glob'.
+    - max_distance (int): Maximum edit distance for the 'symspell' engine.
+    - limit (int): Number of videos to return.
+    - snippets (int): Number of hits shown per video.
+    - writer (MatchWriter): Write the hits as JSONL or CSV rows with rank and score.
+    - search_filter (SearchFilter): Only rank words inside its date range and time window.
+    - context (int): Add the text of that many words on either side of every hit.
+    """
+    index = load_index_or_exit(index_folder)
+
+    log(f"Ranking videos for: '{query}' using the index", writer)
+    start_time = time.perf_counter()
+    results = run_index_rank(index, query, exact, threshold, engine, max_distance, limit, snippets, search_filter, context)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    emit_ranked(results, writer)
+    log(f"\nRanking took {elapsed_ms:.2f} ms.", writer)
+    return results
+
+def search_word_in_index(
+    search_word,
+    index_folder=INDEX_FOLDER,
+    exact=True,
+    threshold=80,
+    engine="vocab",
+    max_distance=2,
+    top_k=None,
+    writer=None,
+    search_filter=None,
+    context=0
+):
+    """
+    Search for a single word in the prebuilt inverted index instead of scanning the transcripts.
+
+    Parameters:
+    - search_word (str): The word to search for.
+    - index_folder (str): Path to the folder containing the index built with 'python search.py index'.
+    - exact (bool): Exact lookup ignoring case and surrounding punctuation. Otherwise fuzzy
+      matching against the index vocabulary, with the same semantics as the transcript scan.
+    - threshold (int): The minimum similarity score (0-100) for fuzzy matching.
+    - engine (str): Fuzzy engine, 'vocab', 'symspell' or 'bktree', 'stem' to match every inflection,
+      or 'regex' or 'glob' to match the query as a pattern against the vocabulary.
+    - max_distance (int): Maximum edit distance for the 'symspell' engine.
+    - top_k (int): Only return the top_k best matches by similarity.
+    - writer (MatchWriter): Write the matches as JSONL or CSV instead of printing them.
+    - search_filter (SearchFilter): Only search words inside its date range and time window.
+    - context (int): Add the text of that many words on either side of every match.
+    """
+    index = load_index_or_exit(index_folder)
+
+    log(f"Searching for the word: '{search_word}' using the index", writer)
+    start_time = time.perf_counter()
+    matches = run_index_search(index, search_word, exact, threshold, engine, max_distance, top_k, search_filter, context)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    emit_matches(matches, writer)
+    log(f"\nLookup took {elapsed_ms:.2f} ms.", writer)
+    return matches
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler for 'python search.py serve'. The loaded index is shared by all
+    request threads through self.server.index.
+
+    GET /search?q=word-or-phrase[&engine=vocab|symspell|bktree|stem|regex|glob][&exact=1][&threshold=80][&max_distance=2][&top_k=N][&context=N]
+        [&from_date=YYYY-MM-DD][&to_date=YYYY-MM-DD][&start_time=MM:SS][&end_time=MM:SS]
+    GET /rank?q=words[&engine=...][&exact=1][&threshold=80][&max_distance=2][&top_k=10][&snippets=3][&from_date=...]
+    GET /complete?q=prefix[&limit=10]
+    GET /health
+    """
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        try:
+            self.handle_get()
+        except Exception as exc:
+            # Answer with JSON instead of dropping the connection with the request thread
+            self.log_error("Error handling %s: %r", self.path, exc)
+            self.send_json(500, {"error": "Internal server error."})
+
+    def handle_get(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/health":
+            self.send_json(200, {"status": "ok", "videos": len(self.server.index.videos)})
+            return
+        if url.path == "/complete":
+            self.send_completions(params)
+            return
+        if url.path not in ("/search", "/rank"):
+            self.send_json(404, {"error": "Not found"})
+            return
+        rank = url.path == "/rank"
+
+        search_word = params.get("q", "").strip()
+        engine = params.get("engine", "vocab")
+        if not search_word:
+            self.send_json(400, {"error": "Missing query parameter 'q'."})
+            return
+        if engine not in ("vocab", "symspell", "bktree", "stem") + PATTERN_ENGINES:
+            self.send_json(400, {"error": f"Unknown engine '{engine}'."})
+            return
+        try:
+            threshold = float(params.get("threshold", 80))
+            max_distance = int(params.get("max_distance", self.server.max_distance))
+            top_k = int(params["top_k"]) if "top_k" in params else None
+            snippets = int(params.get("snippets", 3)) if rank else None
+            context = int(params.get("context", 0))
+        except ValueError:
+            self.send_json(400, {"error": "Invalid numeric parameter."})
+            return
+        if not 0 <= threshold <= 100:
+            self.send_json(400, {"error": "'threshold' must be between 0 and 100."})
+            return
+        for name, value in (("max_distance", max_distance), ("snippets", snippets), ("context", context)):
+            if value is not None and value < 0:
+                self.send_json(400, {"error": f"'{name}' must not be negative."})
+                return
+        if top_k is not None and top_k < 1:
+            self.send_json(400, {"error": "'top_k' must be at least 1."})
+            return
+        if max_distance > self.server.max_distance:
+            # Only the deletion index warmed at startup is served; it answers every smaller distance
+            self.send_json(400, {"error": f"'max_distance' must be at most {self.server.max_distance}."})
+            return
+        if rank and top_k is None:
+            top_k = 10
+        try:
+            search_filter = build_search_filter(
+                params.get("from_date"),
+                params.get("to_date"),
+                params.get("start_time"),
+                params.get("end_time")
+            )
+        except ValueError as exc:
+            self.send_json(400, {"error": str(exc)})
+            return
+
+        exact = params.get("exact", "0").lower() in ("1", "true", "yes")
+        start_time = time.perf_counter()
+        key = search_cache_key(search_word, exact, engine, threshold, max_distance, top_k, search_filter, snippets, context)
+        matches = self.server.cache.get(key) if self.server.cache is not None else None
+        if matches is None:
+            try:
+                if rank:
+                    matches = run_index_rank(
+                        self.server.index,
+                        search_word,
+                        exact,
+                        threshold,
+                        engine,
+                        max_distance,
+                        top_k,
+                        snippets,
+                        search_filter,
+                        context
+                    )
+                else:
+                    matches = run_index_search(
+                        self.server.index,
+                        search_word,
+                        exact,
+                        threshold,
+                        engine,
+                        max_distance,
+                        top_k,
+                        search_filter,
+                        context
+                    )
+            except ValueError as exc:
+                self.send_json(400, {"error": str(exc)})
+                return
+            if self.server.cache is not None:
+                self.server.cache.put(key, matches)
+        took_ms = (time.perf_counter() - start_time) * 1000
+        self.send_json(200, {
+            "query": search_word,
+            "tookMs": round(took_ms, 3),
+            "resultCount": len(matches),
+            "results": matches
+        })
+
+    def send_completions(self, params):
+        try:
+            limit = int(params.get("limit", 10))
+        except ValueError:
+            self.send_json(400, {"error": "Invalid numeric parameter."})
+            return
+        if limit < 0:
+            self.send_json(400, {"error": "'limit' must not be negative."})
+            return
+        prefix = params.get("q", "")
+        start_time = time.perf_counter()
+        completions = self.server.index.prefix_index().complete(prefix, limit)
+        took_ms = (time.perf_counter() - start_time) * 1000
+        self.send_json(200, {
+            "query": prefix,
+            "tookMs": round(took_ms, 3),
+            "resultCount": len(completions),
+            "results": [{"word": word, "count": count} for word, count in completions]
+        })
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def serve(index_folder=INDEX_FOLDER, host="127.0.0.1", port=8765, max_distance=2, verbose=False, use_cache=True):
+    """
+    Run a long-lived search server that keeps the index and its fuzzy engines warm in memory.
+
+    Parameters:
+    - index_folder (str): Path to the folder containing the index.
+    - host (str): Interface to listen on. Defaults to localhost only.
+    - port (int): TCP port to listen on.
+    - max_distance (int): Default and largest maximum edit distance for the 'symspell' engine.
+    - verbose (bool): Log every request.
+    - use_cache (bool): Answer repeated searches from the result cache.
+    """
+    start_time = time.perf_counter()
+    index = load_index_or_exit(index_folder)
+    # Build the lazily created engine structures now so no request pays for them
+    index.deletion_index(max_distance)
+    index.bk_tree()
+    index.prefix_index()
+    print(f"Loaded {len(index.videos)} videos in {time.perf_counter() - start_time:.2f} seconds.")
+
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    server.index = index
+    server.max_distance = max_distance
+    server.verbose = verbose
+    server.cache = open_query_cache(False, index_folder=index_folder) if use_cache else None
+    print(f"Serving search on http://{host}:{port}/search?q=... (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    finally:
+        server.server_close()
+
+def complete_prefix(prefix, index_folder=INDEX_FOLDER, output_folder='output', limit=10):
+    """
+    Print the most frequent words starting with the prefix.
+
+    Uses the prebuilt index when there is one, otherwise builds the autocomplete
+    index straight from the transcription JSON files.
+
+    Parameters:
+    - prefix (str): The start of the word being typed.
+    - index_folder (str): Path to the folder containing the index.
+    - output_folder (str): Folder with the transcription JSON files, used without an index.
+    - limit (int): Maximum number of completions.
+    """
+    if os.path.exists(os.path.join(index_folder, INDEX_FILE)):
+        prefix_index = load_index_or_exit(index_folder).prefix_index()
+    else:
+        try:
+            prefix_index = PrefixIndex.from_transcripts(output_folder)
+        except FileNotFoundError:
+            print(f"Error: The folder '{output_folder}' does not exist.")
+            sys.exit(1)
+
+    start_time = time.perf_counter()
+    completions = prefix_index.complete(prefix, limit)
+    elapsed = time.perf_counter() - start_time
+    for word, count in completions:
+        print(f"{count:>8}  {word}")
+    print(f"Found {len(completions)} completions in {elapsed * 1e6:.0f} µs.")
+
+def read_queries(queries_file):
+    """
+    Read one query per line from a text file, skipping empty lines.
+    """
+    with open(queries_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def batch_search(
+    queries_file,
+    results_file,
+    index_folder=INDEX_FOLDER,
+    threshold=80,
+    workers=-1,
+    top_k=None,
+    search_filter=None,
+    context=0
+):
+    """
+    Answer a whole file of queries and write one JSON line per query.
+
+    Single-word queries are fuzzy matched together in one vectorized pass over the
+    index vocabulary; multi-word queries run as phrase searches. Lines are written in
+    the order of the queries file.
+
+    Parameters:
+    - queries_file (str): Text file with one query per line.
+    - results_file (str): JSONL file to write, or '-' for standard output.
+    - index_folder (str): Path to the folder containing the index.
+    - threshold (int): The minimum similarity score (0-100) to consider a match.
+    - workers (int): Threads used for scoring. -1 uses all cores.
+    - top_k (int): Only write the top_k best matches of each query.
+    - search_filter (SearchFilter): Only search words inside its date range and time window.
+    - context (int): Add the text of that many words on either side of every match.
+    """
+    index = load_index_or_exit(index_folder)
+    if search_filter is not None:
+        index = index.filtered(search_filter)
+    if context:
+        index = index.with_context(context)
+    queries = read_queries(queries_file)
+    words = [query for query in queries if len(query.split()) == 1]
+
+    start_time = time.perf_counter()
+    out = sys.stdout if results_file == '-' else open(results_file, 'w', encoding='utf-8')
+    try:
+        # Word results come in the order of the words, so they are taken one by one as the
+        # queries file reaches them, between the phrases
+        word_results = index.batch_fuzzy_search(words, threshold, workers=workers, top_k=top_k)
+        for query in tqdm(queries, desc="Scoring", unit="query", file=sys.stderr):
+            if len(query.split()) == 1:
+                _, matches = next(word_results)
+            else:
+                try:
+                    matches = index.phrase_search(query, top_k)
+                except ValueError as exc:
+                    out.write(json.dumps({"query": query, "error": str(exc)}, ensure_ascii=False) + "\n")
+                    continue
+            out.write(json.dumps({"query": query, "resultCount": len(matches), "results": matches}, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Answered {len(queries)} queries in {elapsed:.2f} seconds.", file=sys.stderr)
+
+def prompt_search_word():
+    """
+    Ask the user for the word to search for.
     """
     try:
         search_word = input("Enter the word to search for: ").strip()
@@ -151,11 +996,380 @@ def main():
     except KeyboardInterrupt:
         print("\nSearch cancelled by user.")
         sys.exit(0)
+    return search_word
+
+def positive_int(text):
+    """
+    argparse type for options that must be a whole number of at least 1.
+    """
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{text}'") from None
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def add_context_argument(parser):
+    """
+    Add the match context option to a subcommand parser.
+    """
+    parser.add_argument(
+        "--context",
+        type=int,
+        default=0,
+        help="Include N words of transcript text on either side of every match."
+    )
+
+def add_filter_arguments(parser):
+    """
+    Add the upload date and in-video time filters to a subcommand parser.
+    """
+    parser.add_argument("--from-date", help="Only videos uploaded on or after this date (YYYY, YYYY-MM or YYYY-MM-DD).")
+    parser.add_argument("--to-date", help="Only videos uploaded on or before this date (YYYY, YYYY-MM or YYYY-MM-DD).")
+    parser.add_argument("--start-time", help="Only words from this point of each video on (seconds, MM:SS or HH:MM:SS).")
+    parser.add_argument("--end-time", help="Only words before this point of each video (seconds, MM:SS or HH:MM:SS).")
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments. Without a command the script asks for a word interactively.
+    """
+    parser = argparse.ArgumentParser(description="Search Niilo22 transcriptions.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    index_parser = subparsers.add_parser("index", help="Build or update the inverted index from the transcription JSON files.")
+    index_parser.add_argument("--output-folder", default="output", help="Folder containing transcription JSON files.")
+    index_parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder where the index is written.")
+    index_parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of updating.")
+    index_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes reading and stemming transcripts in segments. Defaults to the number of CPU cores."
+    )
+    index_parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=64,
+        help="Megabytes of transcript JSON a worker reads into one segment, bounding its memory."
+    )
+
+    search_parser = subparsers.add_parser("search", help="Search for a word.")
+    search_parser.add_argument(
+        "word",
+        nargs="?",
+        help=(
+            "The word to search for, a phrase like 'joulua odotellessa', or 'kahvia NEAR/5 joulua'. "
+            "Asked interactively if omitted."
+        )
+    )
+    search_parser.add_argument("--exact", action="store_true", help="Exact lookup from the prebuilt index.")
+    search_parser.add_argument(
+        "--engine",
+        choices=["scan", "mmap", "vocab", "symspell", "bktree", "stem", "regex", "glob"],
+        default="scan",
+        help=(
+            "Fuzzy engine: 'scan' reads every transcript, 'mmap' scans the shared memory-mapped store, "
+            "'vocab' scores the index vocabulary once, "
+            "'symspell' looks up typo candidates in the deletion index, "
+            "'bktree' prunes the vocabulary with a BK-tree, "
+            "'stem' matches every Finnish inflection of the word through its stem, "
+            "'regex' and 'glob' match the query as a pattern like '^ni+lo$' or 'luikau*' "
+            "against every distinct word once."
+        )
+    )
+    search_parser.add_argument(
+        "--max-edit-distance",
+        type=int,
+        default=2,
+        help="Maximum edit distance for the 'symspell' engine."
+    )
+    search_parser.add_argument("--threshold", type=int, default=80, help="Minimum fuzzy similarity score (0-100).")
+    search_parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    search_parser.add_argument(
+        "--top-k",
+        type=positive_int,
+        default=None,
+        help="Only keep the best K matches by similarity. With --rank, the number of videos (default 10)."
+    )
+    search_parser.add_argument(
+        "--rank",
+        action="store_true",
+        help="Rank videos by BM25 relevance and show their best hits. Uses the index; 'scan' and 'mmap' rank with 'vocab'."
+    )
+    search_parser.add_argument("--snippets", type=int, default=3, help="Hits shown per video with --rank.")
+    search_parser.add_argument(
+        "--format",
+        choices=["text", "jsonl", "csv"],
+        default="text",
+        help="Output format. 'jsonl' and 'csv' stream matches as soon as each worker finishes."
+    )
+    search_parser.add_argument("--output", default="-", help="File for jsonl/csv output. Defaults to standard output.")
+    search_parser.add_argument("--output-folder", default="output", help="Folder containing transcription JSON files.")
+    search_parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder containing the index.")
+    add_filter_arguments(search_parser)
+    add_context_argument(search_parser)
+    search_parser.add_argument("--no-cache", action="store_true", help="Always recompute results instead of using the result cache.")
 
-    search_word = search_word.lower()
-    search_word = search_word.replace(" ", "")  # Remove spaces for single word search
+    batch_parser = subparsers.add_parser("batch", help="Answer a file of queries and write the results as JSONL.")
+    batch_parser.add_argument("queries_file", help="Text file with one query per line.")
+    batch_parser.add_argument("--output", default="-", help="JSONL file to write. Defaults to standard output.")
+    batch_parser.add_argument("--threshold", type=int, default=80, help="Minimum fuzzy similarity score (0-100).")
+    batch_parser.add_argument("--workers", type=int, default=-1, help="Scoring threads. -1 uses all cores.")
+    batch_parser.add_argument("--top-k", type=positive_int, default=None, help="Only write the best K matches per query.")
+    batch_parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder containing the index.")
+    add_filter_arguments(batch_parser)
+    add_context_argument(batch_parser)
 
-    search_word_in_transcriptions(search_word)
+    complete_parser = subparsers.add_parser("complete", help="Suggest the most frequent words starting with a prefix.")
+    complete_parser.add_argument("prefix", help="The start of the word.")
+    complete_parser.add_argument("--limit", type=int, default=10, help="Maximum number of completions.")
+    complete_parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder containing the index.")
+    complete_parser.add_argument(
+        "--output-folder",
+        default="output",
+        help="Folder containing transcription JSON files, used when there is no index."
+    )
+
+    serve_parser = subparsers.add_parser("serve", help="Serve searches over HTTP from a warm in-memory index.")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on.")
+    serve_parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on.")
+    serve_parser.add_argument("--index-folder", default=INDEX_FOLDER, help="Folder containing the index.")
+    serve_parser.add_argument(
+        "--max-edit-distance",
+        type=int,
+        default=2,
+        help="Default and largest maximum edit distance a request can ask the 'symspell' engine for."
+    )
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    serve_parser.add_argument("--no-cache", action="store_true", help="Always recompute results instead of using the result cache.")
+
+    return parser.parse_args(argv)
+
+def main():
+    """
+    Main function to execute the search.
+    """
+    args = parse_args()
+
+    if args.command == "index":
+        try:
+            build_index(args.output_folder, args.index_folder, args.full, args.workers, args.segment_size * 1024 * 1024)
+        except FileNotFoundError:
+            print(f"Error: The folder '{args.output_folder}' does not exist.")
+            sys.exit(1)
+        return
+
+    search_filter = None
+    if args.command in ("search", "batch"):
+        try:
+            search_filter = build_search_filter(args.from_date, args.to_date, args.start_time, args.end_time)
+        except ValueError as exc:
+            print(f"Error: {exc}")
+            sys.exit(1)
+
+    if args.command == "batch":
+        batch_search(
+            args.queries_file,
+            args.output,
+            args.index_folder,
+            args.threshold,
+            args.workers,
+            args.top_k,
+            search_filter,
+            args.context
+        )
+        return
+
+    if args.command == "complete":
+        complete_prefix(args.prefix, args.index_folder, args.output_folder, args.limit)
+        return
+
+    if args.command == "serve":
+        serve(args.index_folder, args.host, args.port, args.max_edit_distance, args.verbose, not args.no_cache)
+        return
+
+    search_word = getattr(args, "word", None) or prompt_search_word()
+
+    if args.command != "search":
+        # Interactive default: fuzzy scan of the transcripts, or phrase search for several words
+        run_search_command(search_word, use_cache=True)
+        return
+
+    writer = None
+    out = None
+    if args.format != "text":
+        out = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8', newline='')
+        fields = MatchWriter.RANKED_FIELDS if args.rank else MatchWriter.FIELDS
+        writer = MatchWriter(out, args.format, fields + ["context"] if args.context else fields)
+    try:
+        run_search_command(
+            search_word,
+            args.exact,
+            args.engine,
+            args.threshold,
+            args.workers,
+            args.top_k,
+            args.max_edit_distance,
+            args.output_folder,
+            args.index_folder,
+            writer,
+            search_filter,
+            not args.no_cache,
+            args.snippets if args.rank else None,
+            args.context
+        )
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+
+def run_search_command(
+    search_word,
+    exact=False,
+    engine="scan",
+    threshold=80,
+    max_workers=None,
+    top_k=None,
+    max_distance=2,
+    output_folder='output',
+    index_folder=INDEX_FOLDER,
+    writer=None,
+    search_filter=None,
+    use_cache=False,
+    snippets=None,
+    context=0
+):
+    """
+    Dispatch a search to the transcript scan, the shared store scan or the index.
+    Multi-word queries are phrase or NEAR/k searches and are always answered from the index.
+    With snippets set, videos are ranked by BM25 instead, showing that many hits per video.
+    With use_cache, a repeated search is answered from the result cache.
+    With context, every match carries that many words of text on either side.
+    """
+    if snippets is not None:
+        rank_search(
+            search_word,
+            exact,
+            engine,
+            threshold,
+            top_k,
+            max_distance,
+            index_folder,
+            writer,
+            search_filter,
+            use_cache,
+            snippets,
+            context
+        )
+        return
+
+    pattern = engine in PATTERN_ENGINES and not exact
+    phrase = len(search_word.split()) > 1 and not pattern
+    if not phrase and not pattern:
+        search_word = search_word.lower()
+    scan = not phrase and not exact and engine == "scan"
+
+    cache = open_query_cache(scan, output_folder, index_folder) if use_cache else None
+    key = search_cache_key(search_word, exact, engine, threshold, max_distance, top_k, search_filter, context=context)
+    if cache is not None:
+        matches = cache.get(key)
+        if matches is not None:
+            log(f"Searching for: '{search_word}' (cached result)", writer)
+            emit_matches(matches, writer)
+            return
+
+    if phrase:
+        try:
+            matches = search_word_in_index(
+                search_word,
+                index_folder,
+                top_k=top_k,
+                writer=writer,
+                search_filter=search_filter,
+                context=context
+            )
+        except ValueError as exc:
+            print(f"Error: {exc}")
+            sys.exit(1)
+    elif exact or engine not in ("scan", "mmap"):
+        try:
+            matches = search_word_in_index(
+                search_word,
+                index_folder,
+                exact,
+                threshold,
+                engine,
+                max_distance,
+                top_k,
+                writer,
+                search_filter,
+                context
+            )
+        except ValueError as exc:
+            print(f"Error: {exc}")
+            sys.exit(1)
+    elif engine == "mmap":
+        matches = search_word_in_store(search_word, index_folder, threshold, max_workers, top_k, writer, search_filter, context)
+    else:
+        matches = search_word_in_transcriptions(
+            search_word,
+            output_folder,
+            threshold,
+            max_workers,
+            top_k,
+            writer,
+            search_filter,
+            index_folder,
+            context
+        )
+
+    # Scans that streamed their matches through the writer did not collect them
+    streamed = writer is not None and top_k is None and not phrase and not exact and engine in ("scan", "mmap")
+    if cache is not None and not streamed:
+        cache.put(key, matches)
+
+def rank_search(
+    query,
+    exact=False,
+    engine="vocab",
+    threshold=80,
+    limit=None,
+    max_distance=2,
+    index_folder=INDEX_FOLDER,
+    writer=None,
+    search_filter=None,
+    use_cache=False,
+    snippets=3,
+    context=0
+):
+    """
+    Rank videos for the CLI, answering repeated rankings from the result cache.
+    """
+    engine = engine if engine not in ("scan", "mmap") else "vocab"
+    limit = limit or 10
+    cache = open_query_cache(False, index_folder=index_folder) if use_cache else None
+    key = search_cache_key(query, exact, engine, threshold, max_distance, limit, search_filter, snippets, context)
+    if cache is not None:
+        results = cache.get(key)
+        if results is not None:
+            log(f"Ranking videos for: '{query}' (cached result)", writer)
+            emit_ranked(results, writer)
+            return
+    results = rank_videos_in_index(
+        query,
+        index_folder,
+        exact,
+        threshold,
+        engine,
+        max_distance,
+        limit,
+        snippets,
+        writer,
+        search_filter,
+        context
+    )
+    if cache is not None:
+        cache.put(key, results)
 
 if __name__ == "__main__":
     main()
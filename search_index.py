@@ -0,0 +1,1707 @@
+import os
+import re
+import array
+import copy
+import json
+import time
+import threading
+import heapq
+import bisect
+import fnmatch
+import hashlib
+from collections import namedtuple
+import numpy as np
+import snowballstemmer
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Indel, Levenshtein
+from postings import Postings, ranges_mask
+from transcripts import join_words, list_transcripts
+from transcript_store import (
+    SEGMENT_BYTES,
+    StoreFile,
+    TranscriptStore,
+    decode_strings,
+    drop_videos,
+    encode_strings,
+    load_segment,
+    map_shards,
+    merge_segments,
+    merge_vocabularies,
+    read_transcripts,
+    store_arrays,
+    write_store
+)
+
+INDEX_FOLDER = "index"
+INDEX_FILE = "corpus.bin"
+MANIFEST_FILE = "manifest.json"
+INDEX_VERSION = 5
+DELETION_INDEX_FILE = "symspell_d{max_distance}.bin"
+DELETION_PREFIX_LENGTH = 7
+FILE_TERMS_FILE = "file_terms.bin"
+NGRAM_LENGTH = 3
+# Engines that match the query as a pattern against the vocabulary instead of scoring similarity
+PATTERN_ENGINES = ("regex", "glob")
+
+# A segment with the Finnish stem of every vocabulary term, as returned by build_stems
+StemmedSegment = namedtuple("StemmedSegment", ["segment", "stems", "term_stems"])
+
+_EDGE_PUNCTUATION = re.compile(r"^[\W_]+|[\W_]+$")
+_NEAR_OPERATOR = re.compile(r"\s+NEAR/(\d+)\s+")
+# Same algorithm as the 'finnish' text search config used by the web database
+_FINNISH_STEMMER = snowballstemmer.stemmer("finnish")
+
+def normalize_token(word):
+    """
+    Normalize a word for exact lookups: lowercase it and strip surrounding punctuation.
+    Example: "Kahvia," -> "kahvia"
+    """
+    return _EDGE_PUNCTUATION.sub('', word.lower())
+
+def stem_token(word):
+    """
+    Reduce a word to its Finnish Snowball stem after normalizing it.
+    Example: "Kahvia," -> "kahv", like "kahvin" and "kahvit"
+    """
+    return _FINNISH_STEMMER.stemWord(normalize_token(word))
+
+def build_stems(vocabulary):
+    """
+    Stem every vocabulary term. Returns (stems, term_stems): the sorted distinct stems
+    and, for every term id, the index of its stem. Terms that normalize to nothing get
+    the empty stem.
+    """
+    stem_of = {}
+    for term in vocabulary:
+        word = normalize_token(term)
+        if word not in stem_of:
+            stem_of[word] = _FINNISH_STEMMER.stemWord(word)
+    stems = sorted(set(stem_of.values()))
+    stem_ids = {stem: stem_id for stem_id, stem in enumerate(stems)}
+    term_stems = np.array([stem_ids[stem_of[normalize_token(term)]] for term in vocabulary], dtype=np.uint32)
+    return stems, term_stems
+
+def stem_segment(segment):
+    """
+    Stem the vocabulary of a segment into a StemmedSegment.
+    """
+    return StemmedSegment(segment, *build_stems(segment.vocabulary))
+
+def _read_stemmed_shard(output_folder, json_files, progress=False):
+    return stem_segment(read_transcripts(output_folder, json_files, progress))
+
+def merge_stemmed_segments(parts):
+    """
+    Merge StemmedSegments in order, like merge_segments. The sorted stem lists are merged
+    the same way as the vocabularies, so the result equals stemming the merged vocabulary.
+    """
+    vocabulary, remaps = merge_vocabularies([part.segment.vocabulary for part in parts])
+    segment = merge_segments([part.segment for part in parts], (vocabulary, remaps))
+    stems, stem_remaps = merge_vocabularies([part.stems for part in parts])
+    term_stems = np.zeros(len(vocabulary), dtype=np.uint32)
+    for part, remap, stem_remap in zip(parts, remaps, stem_remaps):
+        term_stems[remap] = stem_remap[part.term_stems]
+    return StemmedSegment(segment, stems, term_stems)
+
+def load_stemmed_segment(store):
+    """
+    Copy an index's transcripts and the stems it stores into a StemmedSegment, so an
+    update never stems the existing vocabulary again.
+    """
+    stems = decode_strings(store.arrays["stem_offsets"], store.arrays["stem_bytes"])
+    return StemmedSegment(load_segment(store), stems, store.arrays["term_stems"].copy())
+
+def drop_stemmed_videos(stemmed, file_names):
+    """
+    Return the StemmedSegment without the videos read from the given transcript files,
+    like drop_videos. Stems of the words that are left are kept, the others removed.
+    """
+    segment = drop_videos(stemmed.segment, file_names)
+    if segment is stemmed.segment:
+        return stemmed
+    position = {term: term_id for term_id, term in enumerate(stemmed.segment.vocabulary)}
+    kept = stemmed.term_stems[np.array([position[term] for term in segment.vocabulary], dtype=np.int64)]
+    used = np.unique(kept)
+    return StemmedSegment(segment, [stemmed.stems[i] for i in used.tolist()], np.searchsorted(used, kept).astype(np.uint32))
+
+def read_stemmed_transcripts(output_folder, json_files, workers=None, segment_bytes=SEGMENT_BYTES):
+    """
+    Read and stem transcription JSON files with a process pool. Every worker decodes a
+    shard of files (see transcript_store.map_shards) and stems its own vocabulary, and the
+    parent merges the StemmedSegments in file order.
+    """
+    return merge_stemmed_segments(map_shards(output_folder, json_files, _read_stemmed_shard, workers, segment_bytes))
+
+def parse_phrase_query(query):
+    """
+    Parse a multi-word query into (left_words, right_words, distance).
+
+    - "joulua odotellessa" is a phrase: right_words is None.
+    - "kahvia NEAR/5 joulua" matches the two operands within 5 words of each other, in either order.
+      Operands can be phrases themselves, optionally quoted: "joulua odotellessa" NEAR/10 kahvia
+    Raises ValueError for more than one NEAR operator.
+    """
+    parts = _NEAR_OPERATOR.split(query.strip())
+    operands = [[normalize_token(word) for word in operand.strip().strip('"').split()] for operand in parts[0::2]]
+    operands = [[word for word in operand if word] for operand in operands]
+    if len(operands) == 1:
+        return operands[0], None, 0
+    if len(operands) != 2:
+        raise ValueError("Only one NEAR/k operator per query is supported.")
+    return operands[0], operands[1], int(parts[1])
+
+def build_postings(token_ids, term_count):
+    """
+    Build CSR postings from a token stream: the token positions of term t are
+    postings[postings_offsets[t]:postings_offsets[t + 1]], in increasing order.
+    """
+    postings = np.argsort(token_ids, kind='stable').astype(np.uint32)
+    postings_offsets = np.zeros(term_count + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(token_ids, minlength=term_count), out=postings_offsets[1:])
+    return postings_offsets, postings
+
+def unit_video_pairs(token_units, video_offsets):
+    """
+    Return the distinct (unit, video) pairs of a token stream, where token_units maps every
+    token position to a unit id (a term, stem or lowercased word), sorted by unit then video
+    and encoded as unit * video_count + video. Returns (pairs, video_count).
+    """
+    video_count = max(len(video_offsets) - 1, 1)
+    lengths = np.diff(video_offsets.astype(np.int64))
+    video_of = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    return np.unique(token_units.astype(np.int64) * video_count + video_of), video_count
+
+def document_frequencies(token_units, unit_count, video_offsets):
+    """
+    Return the number of videos that contain each unit (see unit_video_pairs).
+    """
+    pairs, video_count = unit_video_pairs(token_units, video_offsets)
+    return np.bincount(pairs // video_count, minlength=unit_count).astype(np.uint32)
+
+def file_fingerprint(path, previous=None):
+    """
+    Return the manifest entry of a transcript file: size, mtime and SHA-1 of its content.
+    The content is only hashed when size or mtime differ from the previous entry.
+    """
+    stat = os.stat(path)
+    if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        return previous
+    with open(path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1}
+
+def load_manifest(index_folder=INDEX_FOLDER):
+    """
+    Load the manifest of indexed transcript files, or None if there is no usable one.
+    The index file must exist and be an index of the current version, not a plain
+    transcript store or an index some other version wrote.
+    """
+    try:
+        with open(os.path.join(index_folder, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get("version") != INDEX_VERSION:
+        return None
+    try:
+        store = StoreFile(os.path.join(index_folder, INDEX_FILE))
+    except (FileNotFoundError, ValueError):
+        return None
+    header = store.header
+    store.close()
+    if header.get("kind") != "index" or header.get("index_version") != INDEX_VERSION:
+        return None
+    return manifest
+
+def save_manifest(index_folder, files):
+    """
+    Write the manifest of indexed transcript files.
+    """
+    path = os.path.join(index_folder, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": INDEX_VERSION, "files": files}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def diff_transcripts(output_folder, previous_files):
+    """
+    Compare the transcripts in the output folder against the manifest.
+
+    Returns (files, added, changed, deleted) where files is the new manifest content.
+    """
+    files = {}
+    added = []
+    changed = []
+    for json_file in list_transcripts(output_folder):
+        previous = previous_files.get(json_file)
+        files[json_file] = file_fingerprint(os.path.join(output_folder, json_file), previous)
+        if previous is None:
+            added.append(json_file)
+        elif previous["sha1"] != files[json_file]["sha1"]:
+            changed.append(json_file)
+    deleted = [json_file for json_file in previous_files if json_file not in files]
+    return files, added, changed, deleted
+
+def normalized_terms(vocabulary):
+    """
+    Number the normalized forms of the vocabulary terms: terms that differ only in case or
+    surrounding punctuation count as one word. Returns (term_normalized, normalized_ids),
+    the form id of every term and the ids by form.
+    """
+    normalized_ids = {}
+    term_normalized = np.array(
+        [normalized_ids.setdefault(normalize_token(term), len(normalized_ids)) for term in vocabulary],
+        dtype=np.uint32
+    )
+    return term_normalized, normalized_ids
+
+def index_arrays(stemmed):
+    """
+    Build the postings, stems and document frequencies of a StemmedSegment that write_index
+    stores beside its transcripts.
+
+    The stems come from the read workers; postings and document frequencies are built here
+    from the merged token stream with vectorized sorts.
+    """
+    segment, stems, term_stems = stemmed
+    postings_offsets, postings = build_postings(segment.token_ids, len(segment.vocabulary))
+    stem_token_ids = term_stems[segment.token_ids]
+    stem_postings_offsets, stem_postings = build_postings(stem_token_ids, len(stems))
+    term_normalized, normalized_ids = normalized_terms(segment.vocabulary)
+    normalized_df = document_frequencies(term_normalized[segment.token_ids], len(normalized_ids), segment.video_offsets)
+    return {
+        **Postings.encode(postings_offsets, postings).arrays("postings_"),
+        "term_stems": term_stems,
+        **stem_arrays(stems),
+        **Postings.encode(stem_postings_offsets, stem_postings).arrays("stem_postings_"),
+        "term_df": normalized_df[term_normalized],
+        "stem_df": document_frequencies(stem_token_ids, len(stems), segment.video_offsets)
+    }
+
+def stem_arrays(stems):
+    """
+    Return the string table of the stems, named for the index store.
+    """
+    stem_offsets, stem_bytes = encode_strings(stems)
+    return {"stem_offsets": stem_offsets, "stem_bytes": stem_bytes}
+
+def update_postings(postings, old_to_new, unit_count, touched, starts, ends, added_units, kept_count):
+    """
+    Update the postings of an index for a new token stream: the old tokens outside the
+    removed token ranges [starts[i], ends[i]), followed by the added tokens.
+
+    Units (terms or stems) that are not touched keep their compressed blocks and are only
+    shifted (see Postings.shifted). Touched units, the ones that occur in a removed range
+    or among the added tokens, keep the full blocks that end before the first removed
+    range; the rest of their positions is decoded, filtered and encoded again with the
+    added positions. Appending files thus only encodes the last block of every touched unit.
+
+    Parameters:
+    - postings (Postings): Postings of the old units.
+    - old_to_new (np.ndarray): New id of every old unit, -1 for units that are gone.
+    - unit_count (int): Number of new units.
+    - touched (np.ndarray): Boolean mask of the touched old units.
+    - starts, ends (np.ndarray): Sorted, disjoint token ranges of the removed videos.
+    - added_units (np.ndarray): New unit id of every added token.
+    - kept_count (int): Number of old tokens that are kept, the position of the first added token.
+    """
+    untouched = np.flatnonzero(~touched)
+    kept = postings.select(untouched).shifted(starts, ends, kept_count + int(np.sum(ends - starts)))
+    old_ids = np.flatnonzero(touched & (old_to_new >= 0))
+    fresh_ids = np.ones(unit_count, dtype=bool)
+    fresh_ids[old_to_new[untouched]] = False
+    fresh_ids = np.flatnonzero(fresh_ids)
+
+    # Blocks before the last one that starts ahead of the first removed range stay as they are
+    cut = starts[0] if len(starts) else np.iinfo(np.int64).max
+    blocks = postings.blocks.astype(np.int64)
+    started = np.zeros(len(postings.block_first) + 1, dtype=np.int64)
+    np.cumsum(postings.block_first.astype(np.int64) < cut, out=started[1:])
+    head_blocks = np.maximum(started[blocks[old_ids + 1]] - started[blocks[old_ids]] - 1, 0)
+    head = postings.head(old_ids, head_blocks)
+
+    # The other old positions of the touched units, without the removed ranges
+    offsets, positions = postings.decode_terms(old_ids, head_blocks)
+    units = np.repeat(old_to_new[old_ids], np.diff(offsets.astype(np.int64)))
+    outside = ~ranges_mask(positions, starts, ends)
+    positions, units = positions[outside], units[outside]
+    removed = np.zeros(len(ends) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=removed[1:])
+    positions -= removed[np.searchsorted(ends, positions, side='right')]
+
+    # Old positions come first and the added ones follow, so a stable sort by unit keeps both sorted
+    units = np.concatenate([units, added_units.astype(np.int64)])
+    positions = np.concatenate([positions, np.arange(len(added_units), dtype=np.int64) + kept_count])
+    order = np.argsort(units, kind='stable')
+    fresh_offsets = np.zeros(len(fresh_ids) + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(np.searchsorted(fresh_ids, units), minlength=len(fresh_ids)), out=fresh_offsets[1:])
+    fresh = Postings.encode(fresh_offsets, positions[order].astype(np.uint32))
+
+    # Every new unit is a kept one, or a touched head followed by fresh blocks, or only fresh blocks
+    first = np.zeros(unit_count, dtype=np.int64)
+    following = np.full(unit_count, -1, dtype=np.int64)
+    first[old_to_new[untouched]] = np.arange(len(untouched))
+    first[fresh_ids] = np.arange(len(fresh_ids)) + len(kept) + len(head)
+    following[old_to_new[old_ids]] = first[old_to_new[old_ids]]
+    first[old_to_new[old_ids]] = np.arange(len(old_ids)) + len(kept)
+    return Postings.concatenate([kept, head, fresh]).select(first, following)
+
+def update_frequencies(old_df, old_to_new, unit_count, removed_units, removed_offsets, added_units, added_offsets):
+    """
+    Update document frequencies for removed and added videos: the old frequency of a unit,
+    minus the removed videos that contain it, plus the added videos that contain it.
+
+    old_df holds the old frequency of every old unit; old_to_new maps old units to new ids
+    (-1 for gone). removed_units and added_units hold the new unit id of every removed and
+    added token (-1 for gone), split into videos by removed_offsets and added_offsets.
+    A new unit that no remaining old unit carries only occurred in removed videos, if at all.
+    """
+    removed_pairs, removed_videos = unit_video_pairs(removed_units.astype(np.int64) + 1, removed_offsets)
+    removed_df = np.bincount(removed_pairs // removed_videos, minlength=unit_count + 1)[1:]
+    added_df = document_frequencies(added_units, unit_count, added_offsets).astype(np.int64)
+    present = old_to_new >= 0
+    df = removed_df.copy()
+    df[old_to_new[present]] = old_df[present]
+    return (df - removed_df + added_df).astype(np.uint32)
+
+def update_index_arrays(store, existing, removed, stemmed):
+    """
+    Build the arrays of index_arrays for stemmed, the existing index without the removed
+    videos followed by the added ones, from the index store instead of from scratch.
+
+    Postings of the terms and stems that the removed and added videos do not contain are
+    copied compressed, and document frequencies are adjusted by the videos that changed,
+    so an update costs about what the changed videos take.
+
+    Parameters:
+    - store (TranscriptStore): The existing index, still open.
+    - existing (StemmedSegment): Its transcripts and stems (see load_stemmed_segment).
+    - removed (np.ndarray): Sorted ids of the removed videos in existing.
+    - stemmed (StemmedSegment): The updated transcripts.
+    """
+    old, segment = existing.segment, stemmed.segment
+    video_offsets = old.video_offsets.astype(np.int64)
+    starts, ends = video_offsets[removed], video_offsets[removed + 1]
+    removed_offsets = np.zeros(len(removed) + 1, dtype=np.uint64)
+    np.cumsum(ends - starts, out=removed_offsets[1:])
+    removed_tokens = np.concatenate([old.token_ids[start:end] for start, end in zip(starts, ends)] + [old.token_ids[:0]])
+    kept_count = old.token_ids.size - removed_tokens.size
+    # The added videos follow the kept ones
+    kept_videos = len(old.videos) - len(removed)
+    added_terms = segment.token_ids[kept_count:].astype(np.int64)
+    added_offsets = segment.video_offsets[kept_videos:] - segment.video_offsets[kept_videos]
+
+    position = {term: term_id for term_id, term in enumerate(segment.vocabulary)}
+    term_to_new = np.array([position.get(term, -1) for term in old.vocabulary], dtype=np.int64)
+    position = {stem: stem_id for stem_id, stem in enumerate(stemmed.stems)}
+    stem_to_new = np.array([position.get(stem, -1) for stem in existing.stems], dtype=np.int64)
+    added_stems = stemmed.term_stems[added_terms].astype(np.int64)
+
+    term_touched = np.zeros(len(old.vocabulary), dtype=bool)
+    term_touched[removed_tokens] = True
+    in_added = np.zeros(len(segment.vocabulary), dtype=bool)
+    in_added[added_terms] = True
+    term_touched[term_to_new >= 0] |= in_added[term_to_new[term_to_new >= 0]]
+    removed_stems = existing.term_stems[removed_tokens]
+    stem_touched = np.zeros(len(existing.stems), dtype=bool)
+    stem_touched[removed_stems] = True
+    in_added = np.zeros(len(stemmed.stems), dtype=bool)
+    in_added[added_stems] = True
+    stem_touched[stem_to_new >= 0] |= in_added[stem_to_new[stem_to_new >= 0]]
+
+    postings = update_postings(
+        Postings.from_arrays(store.arrays, "postings_"), term_to_new, len(segment.vocabulary),
+        term_touched, starts, ends, added_terms, kept_count
+    )
+    stem_postings = update_postings(
+        Postings.from_arrays(store.arrays, "stem_postings_"), stem_to_new, len(stemmed.stems),
+        stem_touched, starts, ends, added_stems, kept_count
+    )
+
+    # Old terms carry the frequency of their normalized form; a term that is gone still
+    # counts as removed for its form, which other terms may carry on
+    term_normalized, normalized_ids = normalized_terms(segment.vocabulary)
+    present = term_to_new >= 0
+    carried = np.full(len(old.vocabulary), -1, dtype=np.int64)
+    carried[present] = term_normalized[term_to_new[present]]
+    removed_normalized = carried.copy()
+    for term_id in np.flatnonzero(~present).tolist():
+        removed_normalized[term_id] = normalized_ids.get(normalize_token(old.vocabulary[term_id]), -1)
+    normalized_df = update_frequencies(
+        store.arrays["term_df"].astype(np.int64), carried, len(normalized_ids),
+        removed_normalized[removed_tokens], removed_offsets,
+        term_normalized[added_terms], added_offsets
+    )
+    stem_df = update_frequencies(
+        store.arrays["stem_df"].astype(np.int64), stem_to_new, len(stemmed.stems),
+        stem_to_new[removed_stems], removed_offsets,
+        added_stems, added_offsets
+    )
+    return {
+        **postings.arrays("postings_"),
+        "term_stems": stemmed.term_stems,
+        **stem_arrays(stemmed.stems),
+        **stem_postings.arrays("stem_postings_"),
+        "term_df": normalized_df[term_normalized],
+        "stem_df": stem_df
+    }
+
+def write_index(index_folder, output_folder, stemmed, postings_arrays=None):
+    """
+    Write a StemmedSegment as the index file, adding postings that map every distinct word
+    (as written in the transcripts) to its token positions, the Finnish stem of every
+    word and postings that map every stem to the positions of all its inflections.
+    Document frequencies of every normalized word and stem are stored for BM25 ranking.
+    Both postings are stored compressed (see postings.Postings).
+
+    postings_arrays are the arrays of index_arrays, if the caller already built them
+    (see update_index_arrays).
+    """
+    arrays = store_arrays(stemmed.segment)
+    arrays.update(index_arrays(stemmed) if postings_arrays is None else postings_arrays)
+
+    os.makedirs(index_folder, exist_ok=True)
+    index_path = os.path.join(index_folder, INDEX_FILE)
+    write_store(
+        index_path,
+        {
+            "kind": "index",
+            "index_version": INDEX_VERSION,
+            "output_folder": os.path.abspath(output_folder),
+            "videos": stemmed.segment.videos
+        },
+        arrays
+    )
+    return index_path
+
+def build_index(output_folder='output', index_folder=INDEX_FOLDER, full=False, workers=None, segment_bytes=SEGMENT_BYTES):
+    """
+    Build or update the inverted index from the transcription JSON files in the output folder.
+
+    The index file is a transcript store (see transcript_store.py) extended with postings.
+    Word timestamps and videos are read from the store columns at the posting positions.
+    A manifest records the size, mtime and content hash of every transcript file, so later
+    runs only read added or changed transcripts and merge them into the existing index:
+    postings, document frequencies and the pruning sidecar are only rebuilt for the words
+    of the removed and added videos (see update_index_arrays and update_file_terms).
+    Transcripts are read and their vocabularies stemmed by a process pool in segments
+    (see read_stemmed_transcripts).
+
+    Parameters:
+    - output_folder (str): Path to the folder containing transcription JSON files.
+    - index_folder (str): Path to the folder where the index is written.
+    - full (bool): Ignore the manifest and rebuild the index from scratch.
+    - workers (int): Number of processes reading and stemming transcripts. None defaults to CPU core count.
+    - segment_bytes (int): Maximum transcript JSON bytes a worker reads into one segment.
+
+    Returns the path of the index file.
+    """
+    start_time = time.time()
+    manifest = None if full else load_manifest(index_folder)
+    files, added, changed, deleted = diff_transcripts(output_folder, manifest["files"] if manifest else {})
+    index_path = os.path.join(index_folder, INDEX_FILE)
+
+    # Set when an update builds the postings and the pruning sidecar from the existing ones
+    postings_arrays = None
+    file_terms = None
+    if manifest is None:
+        stemmed = read_stemmed_transcripts(output_folder, sorted(files), workers, segment_bytes)
+    elif not (added or changed or deleted):
+        save_manifest(index_folder, files)  # Remember refreshed mtimes of touched but unchanged files
+        file_terms = FileTermIndex.load(index_folder)
+        fingerprints = {name: [entry["size"], entry["mtime_ns"]] for name, entry in files.items()}
+        if file_terms is None or file_terms.files != fingerprints:
+            if file_terms is not None:
+                file_terms.close()
+            store = TranscriptStore(index_path)
+            write_file_terms(index_folder, load_segment(store), files)
+            store.close()
+        else:
+            file_terms.close()
+        print("Index is up to date.")
+        return index_path
+    else:
+        print(f"Updating index: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted transcripts.")
+        store = TranscriptStore(index_path)
+        existing = load_stemmed_segment(store)
+        dropped = set(changed) | set(deleted)
+        old_files = [video["file_name"] for video in existing.segment.videos]
+        removed = np.array([video_id for video_id, name in enumerate(old_files) if name in dropped], dtype=np.int64)
+        stemmed = merge_stemmed_segments([
+            drop_stemmed_videos(existing, dropped),
+            read_stemmed_transcripts(output_folder, sorted(added + changed), workers, segment_bytes)
+        ])
+        postings_arrays = update_index_arrays(store, existing, removed, stemmed)
+        store.close()
+        file_terms = FileTermIndex.load(index_folder)
+        if file_terms is not None and file_terms.videos != old_files:
+            file_terms.close()
+            file_terms = None
+
+    write_index(index_folder, output_folder, stemmed, postings_arrays)
+    if file_terms is None:
+        write_file_terms(index_folder, stemmed.segment, files)
+    else:
+        update_file_terms(index_folder, file_terms, removed, stemmed.segment, files)
+    save_manifest(index_folder, files)
+
+    elapsed = time.time() - start_time
+    print(f"Indexed {len(stemmed.segment.videos)} videos and {len(stemmed.segment.vocabulary)} distinct words in {elapsed:.2f} seconds.")
+    return index_path
+
+def write_file_terms(index_folder, segment, files):
+    """
+    Write the file pruning sidecar: the lowercased vocabulary and, for every word, the
+    transcript files that contain it (CSR: term_file_offsets / term_files, ids into the
+    header's file list). The size and mtime of every indexed file are recorded, so files
+    changed since are never pruned.
+    """
+    vocabulary, word_of_term = lowercased_terms(segment.vocabulary)
+    pairs, video_count = unit_video_pairs(word_of_term[segment.token_ids], segment.video_offsets)
+    save_file_terms(index_folder, segment, files, vocabulary, pairs // video_count, pairs % video_count)
+
+def update_file_terms(index_folder, file_terms, removed, segment, files):
+    """
+    Write the file pruning sidecar of an updated segment, whose videos are the ones of the
+    open sidecar without the removed ids, followed by the added ones. The word and file
+    pairs of the kept files are copied from the sidecar, which is closed before it is replaced.
+    """
+    vocabulary, word_of_term = lowercased_terms(segment.vocabulary)
+    word_ids = {word: word_id for word_id, word in enumerate(vocabulary)}
+    old_words = np.array([word_ids.get(word, -1) for word in file_terms.vocabulary], dtype=np.int64)
+    words = np.repeat(old_words, np.diff(file_terms.term_file_offsets.astype(np.int64)))
+    file_ids = file_terms.term_files.astype(np.int64)
+    kept_videos = len(file_terms.videos) - len(removed)
+    file_terms.close()
+    kept = ~np.isin(file_ids, removed)
+    words, file_ids = words[kept], file_ids[kept] - np.searchsorted(removed, file_ids[kept])
+
+    start = segment.video_offsets[kept_videos]
+    pairs, video_count = unit_video_pairs(word_of_term[segment.token_ids[start:]], segment.video_offsets[kept_videos:] - start)
+    file_count = max(len(segment.videos), 1)
+    keys = np.sort(np.concatenate([
+        words * file_count + file_ids,
+        pairs // video_count * file_count + pairs % video_count + kept_videos
+    ]))
+    save_file_terms(index_folder, segment, files, vocabulary, keys // file_count, keys % file_count)
+
+def lowercased_terms(vocabulary):
+    """
+    Return the sorted lowercased words of the vocabulary and the word id of every term.
+    """
+    words = [term.lower() for term in vocabulary]
+    lowercased = sorted(set(words))
+    word_ids = {word: word_id for word_id, word in enumerate(lowercased)}
+    return lowercased, np.array([word_ids[word] for word in words], dtype=np.int64)
+
+def save_file_terms(index_folder, segment, files, vocabulary, words, file_ids):
+    """
+    Write the file pruning sidecar from its (word, file) pairs, sorted by word then file.
+    """
+    term_file_offsets = np.zeros(len(vocabulary) + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(words, minlength=len(vocabulary)), out=term_file_offsets[1:])
+    vocab_offsets, vocab_bytes = encode_strings(vocabulary)
+    write_store(
+        os.path.join(index_folder, FILE_TERMS_FILE),
+        {
+            "kind": "file_terms",
+            "index_version": INDEX_VERSION,
+            "videos": [video["file_name"] for video in segment.videos],
+            "files": {name: [entry["size"], entry["mtime_ns"]] for name, entry in files.items()}
+        },
+        {
+            "vocab_offsets": vocab_offsets,
+            "vocab_bytes": vocab_bytes,
+            "term_file_offsets": term_file_offsets,
+            "term_files": file_ids.astype(np.uint32)
+        }
+    )
+
+class FileTermIndex(StoreFile):
+    """
+    Sidecar written by build_index that tells the transcript scan which files can
+    contain a match, so the others are never opened.
+
+    The query is scored once against the lowercased vocabulary with the scan's own rule
+    (fuzz.ratio of the lowercased words), so pruning never drops a match. Files that were
+    added or changed after the index was built are always scanned.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        if self.header.get("kind") != "file_terms" or self.header.get("index_version") != INDEX_VERSION:
+            raise ValueError("Unsupported file pruning sidecar, rebuild it with 'python search.py index'.")
+        self.videos = self.header["videos"]
+        self.files = self.header["files"]
+        self.term_file_offsets = self.arrays["term_file_offsets"]
+        self.term_files = self.arrays["term_files"]
+        self.vocabulary = decode_strings(self.arrays["vocab_offsets"], self.arrays["vocab_bytes"])
+
+    def close(self):
+        self.term_file_offsets = self.term_files = None
+        super().close()
+
+    @classmethod
+    def load(cls, index_folder=INDEX_FOLDER):
+        """
+        Load the sidecar from the index folder, or return None if there is no usable one.
+        """
+        try:
+            return cls(os.path.join(index_folder, FILE_TERMS_FILE))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def candidate_files(self, search_word, threshold=80):
+        """
+        Return the names of the indexed files that contain a word similar enough to the query.
+        """
+        candidates = process.extract(
+            search_word.lower(),
+            self.vocabulary,
+            scorer=fuzz.ratio,
+            score_cutoff=threshold,
+            limit=None
+        )
+        file_ids = [
+            self.term_files[int(self.term_file_offsets[word_id]):int(self.term_file_offsets[word_id + 1])]
+            for _, _, word_id in candidates
+        ]
+        if not file_ids:
+            return set()
+        return {self.videos[file_id] for file_id in np.unique(np.concatenate(file_ids)).tolist()}
+
+    def prune(self, json_files, output_folder, search_word, threshold=80):
+        """
+        Drop the files that cannot contain a match. Returns the files to scan.
+
+        A file is dropped when it is unchanged since the index was built and none of its
+        words is similar enough to the query. Files the index skipped (invalid filename or
+        JSON) have no words and are dropped as well while unchanged.
+        """
+        candidates = self.candidate_files(search_word, threshold)
+        remaining = []
+        for json_file in json_files:
+            entry = self.files.get(json_file)
+            if json_file in candidates or entry is None:
+                remaining.append(json_file)
+                continue
+            stat = os.stat(os.path.join(output_folder, json_file))
+            if [stat.st_size, stat.st_mtime_ns] != entry:
+                remaining.append(json_file)
+        return remaining
+
+def generate_deletes(word, max_distance, prefix_length=DELETION_PREFIX_LENGTH):
+    """
+    Return every string obtained by deleting up to max_distance characters from the
+    word's prefix, including the prefix itself.
+    """
+    word = word[:prefix_length]
+    deletes = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for candidate in frontier:
+            for i in range(len(candidate)):
+                next_frontier.add(candidate[:i] + candidate[i + 1:])
+        next_frontier -= deletes
+        deletes |= next_frontier
+        frontier = next_frontier
+    return deletes
+
+def delete_key(delete):
+    """
+    Return the 64-bit key of a deletion string, the same in every process.
+    """
+    return int.from_bytes(hashlib.blake2b(delete.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class DeletionIndex:
+    """
+    SymSpell-style symmetric deletion index over the lowercased vocabulary.
+
+    Every vocabulary word is stored under all the strings reachable by deleting up to
+    max_distance characters from its prefix. A lookup generates the same deletions for the
+    query, so the candidates for a typo are found with a few binary searches instead
+    of comparing the query against the whole vocabulary.
+
+    The deletions are kept as sorted 64-bit keys (see delete_key) with CSR lists of
+    vocabulary positions: key k lists positions[offsets[k]:offsets[k + 1]]. A persisted
+    index is memory-mapped instead of parsed. A key collision only adds a candidate,
+    which the distance check of lookup drops.
+    """
+
+    def __init__(self, vocabulary, max_distance, keys, offsets, positions):
+        self.vocabulary = vocabulary
+        self.max_distance = max_distance
+        self.keys = keys
+        self.offsets = offsets
+        self.positions = positions
+
+    @classmethod
+    def build(cls, vocabulary, max_distance=2):
+        """
+        Precompute the deletions of every word in the vocabulary.
+        """
+        keys = array.array('Q')
+        positions = array.array('I')
+        for position, word in enumerate(vocabulary):
+            deletes = generate_deletes(word, max_distance)
+            keys.extend(delete_key(delete) for delete in deletes)
+            positions.extend([position] * len(deletes))
+        keys = np.frombuffer(keys, dtype=np.uint64)
+        positions = np.frombuffer(positions, dtype=np.uint32)
+        order = np.argsort(keys, kind='stable')
+        keys, starts = np.unique(keys[order], return_index=True)
+        offsets = np.append(starts, order.size).astype(np.uint64)
+        return cls(vocabulary, max_distance, keys, offsets, positions[order])
+
+    @classmethod
+    def load_or_build(cls, vocabulary, index_folder=INDEX_FOLDER, max_distance=2, signature=None):
+        """
+        Open the persisted deletion index of this index, or build and persist it if it is
+        missing or was built for an index with a different signature.
+        """
+        path = os.path.join(index_folder, DELETION_INDEX_FILE.format(max_distance=max_distance))
+        try:
+            store = StoreFile(path)
+            header = store.header
+            if (
+                header.get("kind") == "deletion_index"
+                and header.get("index_version") == INDEX_VERSION
+                and header.get("signature") == signature
+                and header.get("max_distance") == max_distance
+            ):
+                return cls(vocabulary, max_distance, store.arrays["keys"], store.arrays["offsets"], store.arrays["positions"])
+            store.close()
+        except (FileNotFoundError, ValueError):
+            pass
+
+        deletion_index = cls.build(vocabulary, max_distance)
+        deletion_index.save(path, signature)
+        return deletion_index
+
+    def save(self, path, signature=None):
+        """
+        Persist the deletion index as a store file, tagged with the signature of its index.
+        """
+        write_store(
+            path,
+            {"kind": "deletion_index", "index_version": INDEX_VERSION, "max_distance": self.max_distance, "signature": signature},
+            {"keys": self.keys, "offsets": self.offsets, "positions": self.positions}
+        )
+
+    def lookup(self, word, max_distance=None):
+        """
+        Return (position, distance) pairs for every vocabulary word within max_distance
+        Levenshtein edits of the word, in vocabulary order. max_distance defaults to the
+        index's own and can only be smaller: the stored deletions of every word include
+        those a smaller distance would store.
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        word = word.lower()
+        keys = np.array([delete_key(delete) for delete in generate_deletes(word, max_distance)], dtype=np.uint64)
+        slots = np.minimum(np.searchsorted(self.keys, keys), max(self.keys.size - 1, 0))
+        slots = slots[self.keys[slots] == keys] if self.keys.size else slots[:0]
+        starts = self.offsets[slots].astype(np.int64)
+        ends = self.offsets[slots + 1].astype(np.int64)
+        positions = [self.positions[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+        results = []
+        for position in np.unique(np.concatenate(positions) if positions else np.zeros(0, dtype=np.uint32)).tolist():
+            candidate = self.vocabulary[position]
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            distance = Levenshtein.distance(word, candidate, score_cutoff=max_distance)
+            if distance <= max_distance:
+                results.append((position, distance))
+        return results
+
+class BKTree:
+    """
+    Burkhard-Keller tree over the lowercased vocabulary, using the Indel distance
+    (insertions and deletions only) as the metric.
+
+    fuzz.ratio is 100 * (1 - indel / (len(a) + len(b))), so a ratio threshold translates
+    into a distance radius around the query. The triangle inequality then lets a query
+    skip every subtree whose edge distance is outside that radius.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.root = None
+        for position, word in enumerate(vocabulary):
+            self.add(position, word)
+
+    def add(self, position, word):
+        """
+        Insert a vocabulary position into the tree.
+        """
+        if self.root is None:
+            self.root = (position, {})
+            return
+        node = self.root
+        while True:
+            distance = Indel.distance(word, self.vocabulary[node[0]])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (position, {})
+                return
+            node = child
+
+    def search(self, word, radius):
+        """
+        Return (position, distance) pairs for every vocabulary word within the radius.
+        """
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            position, children = stack.pop()
+            distance = Indel.distance(word, self.vocabulary[position])
+            if distance <= radius:
+                results.append((position, distance))
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return results
+
+def ratio_radius(query_length, threshold):
+    """
+    Largest Indel distance any word can have from a query of this length while still
+    reaching the fuzz.ratio threshold.
+
+    A word of length n matches only if indel <= r * (query_length + n) with r = 1 - threshold / 100,
+    and indel >= n - query_length bounds n by query_length * (1 + r) / (1 - r).
+    """
+    r = (100 - threshold) / 100
+    if r >= 1:
+        return float('inf')
+    if r <= 0:
+        return 0
+    return r * query_length * 2 / (1 - r) + 1e-9
+
+def compile_pattern(pattern, glob=False):
+    """
+    Compile a regex or glob query for matching normalized words, ignoring case.
+    A regex matches anywhere in a word unless anchored with ^ and $; a glob matches the
+    whole word. Raises ValueError for an invalid pattern.
+    """
+    try:
+        if glob:
+            return re.compile(fnmatch.translate(pattern.lower()), re.IGNORECASE)
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error as exc:
+        raise ValueError(f"Invalid pattern '{pattern}': {exc}.") from exc
+
+def pattern_literals(pattern, glob=False):
+    """
+    Return lowercased substrings that every word matching the pattern must contain.
+
+    Glob literals are the text between wildcards. Regex literals are the runs of plain
+    characters outside classes, dropping a character made optional by ?, * or {m,n}.
+    Patterns with groups or alternation give no literals, which is always safe: the
+    literals only narrow the words a pattern is tried against.
+    Example: "^ni+lo$" -> ["ni", "lo"], "luikau*" -> ["luikau"]
+    """
+    if glob:
+        return [literal.lower() for literal in re.split(r"[*?]|\[[^\]]*\]", pattern) if literal]
+    if "|" in pattern or "(" in pattern:
+        return []
+
+    literals = []
+    run = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1:i + 2]
+            i += 2
+            if escaped and not escaped.isalnum():
+                run += escaped
+                continue
+        elif char == "[":
+            # Skip the class; a ] right after [ or [^ is part of it
+            i += 2 if pattern[i + 1:i + 2] == "^" else 1
+            i = pattern.find("]", i + 1)
+            i = len(pattern) if i < 0 else i + 1
+        elif char in "?*{":
+            run = run[:-1]
+            if char == "{":
+                i = pattern.find("}", i)
+                i = len(pattern) if i < 0 else i
+            i += 1
+        elif char == "+":
+            i += 1
+        elif char in ".^$":
+            i += 1
+        else:
+            run += char
+            i += 1
+            continue
+        if run:
+            literals.append(run.lower())
+        run = ""
+    if run:
+        literals.append(run.lower())
+    return literals
+
+class NgramIndex:
+    """
+    N-gram index over a list of words: every n-character substring maps to the sorted
+    positions of the words that contain it.
+
+    A pattern query intersects the lists of the n-grams of its required literals (see
+    pattern_literals) and only tries the pattern against the surviving words.
+    """
+
+    def __init__(self, words, n=NGRAM_LENGTH):
+        self.words = words
+        self.n = n
+        grams = {}
+        for position, word in enumerate(words):
+            for gram in {word[i:i + n] for i in range(len(word) - n + 1)}:
+                grams.setdefault(gram, []).append(position)
+        self.grams = {gram: np.array(positions, dtype=np.uint32) for gram, positions in grams.items()}
+
+    def candidates(self, literals):
+        """
+        Return the sorted positions of the words containing every n-gram of the literals,
+        or None if the literals are too short to narrow anything down.
+        """
+        grams = {literal[i:i + self.n] for literal in literals for i in range(len(literal) - self.n + 1)}
+        if not grams:
+            return None
+        postings = sorted((self.grams.get(gram, np.zeros(0, dtype=np.uint32)) for gram in grams), key=len)
+        positions = postings[0]
+        for other in postings[1:]:
+            if positions.size == 0:
+                break
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        return positions
+
+class PrefixIndex:
+    """
+    Autocomplete index over the normalized vocabulary: the words in sorted order with
+    their corpus frequencies.
+
+    The completions of a prefix are a contiguous range of the sorted words, found with
+    binary search. A sparse table of range-maximum positions over the frequencies then
+    yields the most frequent words of that range one by one, so a query costs
+    O(limit * log limit) no matter how many words share the prefix.
+    """
+
+    def __init__(self, words, counts):
+        order = sorted(range(len(words)), key=words.__getitem__)
+        self.words = [words[i] for i in order]
+        self.counts = np.asarray(counts, dtype=np.int64)[order]
+
+        # levels[k][i] is the position of the most frequent word in words[i:i + 2**k],
+        # the leftmost (alphabetically first) one on ties
+        self.levels = [np.arange(len(self.words), dtype=np.int32)]
+        width = 1
+        while width * 2 <= len(self.words):
+            previous = self.levels[-1]
+            left, right = previous[:-width], previous[width:]
+            self.levels.append(np.where(self.counts[left] >= self.counts[right], left, right))
+            width *= 2
+
+    @classmethod
+    def from_terms(cls, terms, counts):
+        """
+        Build from store vocabulary terms and their occurrence counts, merging the
+        terms that normalize to the same word.
+        """
+        totals = {}
+        for term, count in zip(terms, counts.tolist()):
+            word = normalize_token(term)
+            if word and count:
+                totals[word] = totals.get(word, 0) + count
+        return cls(list(totals), list(totals.values()))
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Build from a loaded TranscriptIndex, counting occurrences from its postings.
+        """
+        return cls.from_terms(index.terms, index.postings.counts())
+
+    @classmethod
+    def from_transcripts(cls, output_folder='output'):
+        """
+        Build directly from the transcription JSON files, without an index.
+        """
+        segment = read_transcripts(output_folder)
+        return cls.from_terms(segment.vocabulary, np.bincount(segment.token_ids, minlength=len(segment.vocabulary)))
+
+    def range_max(self, start, end):
+        """
+        Return the position of the most frequent word in words[start:end].
+        """
+        level = (end - start).bit_length() - 1
+        left = int(self.levels[level][start])
+        right = int(self.levels[level][end - (1 << level)])
+        return left if self.counts[left] >= self.counts[right] else right
+
+    def complete(self, prefix, limit=10):
+        """
+        Return up to limit (word, count) pairs for the words starting with the prefix,
+        most frequent first. The prefix is normalized like the indexed words.
+        """
+        prefix = normalize_token(prefix)
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + "\U0010ffff", start)
+        completions = []
+        heap = []
+        if start < end:
+            best = self.range_max(start, end)
+            heap.append((-int(self.counts[best]), best, start, end))
+        while heap and len(completions) < limit:
+            count, best, start, end = heapq.heappop(heap)
+            completions.append((self.words[best], -count))
+            for start, end in ((start, best), (best + 1, end)):
+                if start < end:
+                    position = self.range_max(start, end)
+                    heapq.heappush(heap, (-int(self.counts[position]), position, start, end))
+        return completions
+
+class TranscriptIndex:
+    """
+    Memory-mapped view of the index written by build_index().
+    Terms are addressed by their token id in the store vocabulary.
+    """
+
+    def __init__(self, store):
+        if store.header.get("index_version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version, rebuild it with 'python search.py index'.")
+        self.store = store
+        self.videos = store.videos
+        self.terms = store.vocabulary
+        self.postings = Postings.from_arrays(store.arrays, "postings_")
+        self.term_stems = store.arrays["term_stems"]
+        self.stem_postings = Postings.from_arrays(store.arrays, "stem_postings_")
+        self.term_df = store.arrays["term_df"]
+        self.stem_df = store.arrays["stem_df"]
+
+        self.build_lookups(range(len(self.terms)))
+        self.index_folder = None
+        # Sorted (starts, ends) token ranges a filtered view is restricted to, see filtered()
+        self.window = None
+        # Words of context added to every match on either side, see with_context()
+        self.context_words = 0
+
+    def build_lookups(self, term_ids):
+        """
+        Build the word lookups over the given term ids and reset the engine structures
+        that are built from them on first use.
+        """
+        # Map normalized tokens to the term ids that normalize to them
+        self.by_token = {}
+        # Map lowercased words to their term ids; the keys form the fuzzy vocabulary
+        by_lower = {}
+        for term_id in term_ids:
+            term = self.terms[term_id]
+            self.by_token.setdefault(normalize_token(term), []).append(term_id)
+            by_lower.setdefault(term.lower(), []).append(term_id)
+        self.vocabulary = list(by_lower)
+        self.vocabulary_terms = list(by_lower.values())
+        self.deletion_indexes = {}
+        # Held while a deletion index is opened or built, so request threads never build one twice
+        self._deletion_lock = threading.Lock()
+        # Engine structures built on first use, by name. Views made with filtered() and
+        # with_context() share this dict, so a structure built through a view is kept.
+        self._structures = {}
+
+    def filtered(self, search_filter):
+        """
+        Return a view of the index restricted to the words inside the filter's upload date
+        range and in-video time window (see transcripts.SearchFilter).
+
+        The view shares the postings, the vocabulary and every engine structure with the
+        index. Candidate words are still scored against the whole vocabulary, then only the
+        positions of the matched words that fall inside the filter are decoded and kept (see
+        Postings.positions_in), so building the view costs O(videos) and a query never costs
+        more than it does unfiltered.
+        Document frequencies stay index-wide.
+        """
+        ranges = np.array(self.store.window_ranges(search_filter), dtype=np.int64).reshape(-1, 2)
+        view = copy.copy(self)
+        view.window = (ranges[:, 0].copy(), ranges[:, 1].copy())
+        return view
+
+    def window_mask(self, positions):
+        """
+        Return a boolean mask of which token positions are inside the view's filter.
+        """
+        if self.window is None:
+            return np.ones(len(positions), dtype=bool)
+        return ranges_mask(positions, *self.window)
+
+    def with_context(self, context_words):
+        """
+        Return a view of the index whose matches carry a "context" field: the transcript
+        text from context_words words before the match to context_words words after it,
+        within the same video. The words are sliced from the token id column and looked
+        up in the vocabulary, so each match costs O(context_words) and no JSON is read.
+        """
+        view = copy.copy(self)
+        view.context_words = context_words
+        return view
+
+    def context_text(self, video, start, end):
+        """
+        Return the context of the token positions start..end (inclusive) of a video.
+        """
+        video_start, video_end = self.store.video_range(video)
+        first = max(video_start, start - self.context_words)
+        last = min(video_end, end + 1 + self.context_words)
+        return join_words(self.terms[token_id] for token_id in self.store.token_ids[first:last].tolist())
+
+    @classmethod
+    def load(cls, index_folder=INDEX_FOLDER):
+        """
+        Load the index from the index folder.
+        Raises FileNotFoundError if the index has not been built yet.
+        """
+        index = cls(TranscriptStore(os.path.join(index_folder, INDEX_FILE)))
+        index.index_folder = index_folder
+        return index
+
+    def term_positions(self, term_id, limit=None):
+        """
+        Return the token positions of every occurrence of a term, or only the first limit.
+        In a filtered view only the occurrences inside the filter count.
+        """
+        if self.window is None:
+            return self.postings.positions(term_id, limit)
+        return self.postings.positions_in(term_id, *self.window)[:limit]
+
+    def positions_to_matches(self, positions, similarities):
+        """
+        Build match_info dicts for token positions.
+
+        Parameters:
+        - positions (np.ndarray): Token positions of the matched words.
+        - similarities (list or float): Similarity of each position, or one similarity for all of them.
+        """
+        if not isinstance(similarities, list):
+            similarities = [similarities] * len(positions)
+        matches = []
+        for video, position, token_id, start, end, similarity in zip(
+            self.store.videos_of(positions).tolist(),
+            np.asarray(positions).tolist(),
+            self.store.token_ids[positions].tolist(),
+            self.store.start_ms[positions].tolist(),
+            self.store.end_ms[positions].tolist(),
+            similarities
+        ):
+            video_info = self.videos[video]
+            match_info = {
+                "video_id": video_info["youtube_id"],
+                "video_name": video_info["video_name"],
+                "matched_word": self.terms[token_id],
+                "start_time": start / 1000,
+                "end_time": end / 1000,
+                "similarity": similarity
+            }
+            if self.context_words:
+                match_info["context"] = self.context_text(video, position, position)
+            matches.append(match_info)
+        return matches
+
+    def expand_term(self, term_id, similarity):
+        """
+        Expand a term to the match_info dicts of all its occurrences.
+        """
+        return self.positions_to_matches(self.term_positions(term_id), similarity)
+
+    def exact_search(self, search_word, top_k=None):
+        """
+        Return match_info dicts for every occurrence of the word, ignoring case and
+        surrounding punctuation, or only the first top_k. Never opens any transcript files.
+        """
+        matches = []
+        for term_id in self.by_token.get(normalize_token(search_word), []):
+            positions = self.term_positions(term_id, None if top_k is None else top_k - len(matches))
+            matches.extend(self.positions_to_matches(positions, 100.0))
+        return matches
+
+    def stem_id(self, search_word):
+        """
+        Return the id of the word's stem, or None if no indexed word shares it.
+        """
+        if "by_stem" not in self._structures:
+            stems = decode_strings(self.store.arrays["stem_offsets"], self.store.arrays["stem_bytes"])
+            self._structures["by_stem"] = {stem: stem_id for stem_id, stem in enumerate(stems) if stem}
+        return self._structures["by_stem"].get(stem_token(search_word))
+
+    def stem_positions(self, search_word, limit=None):
+        """
+        Return the token positions of every inflection of the word, found with a single
+        lookup of its stem, or only the first limit. Empty if no indexed word shares the stem.
+        In a filtered view only the occurrences inside the filter count.
+        """
+        stem_id = self.stem_id(search_word)
+        if stem_id is None:
+            return np.zeros(0, dtype=np.int64)
+        if self.window is None:
+            return self.stem_postings.positions(stem_id, limit)
+        return self.stem_postings.positions_in(stem_id, *self.window)[:limit]
+
+    def stem_search(self, search_word, top_k=None):
+        """
+        Return match_info dicts for every inflection of the word, or only the first top_k.
+        "kahvia" also matches "kahvin" and "kahvit", without any fuzzy scoring.
+        """
+        return self.positions_to_matches(self.stem_positions(search_word, top_k), 100.0)
+
+    def word_positions(self, word):
+        """
+        Return the sorted token positions of every surface form that normalizes to the word.
+        """
+        term_ids = self.by_token.get(normalize_token(word), [])
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.concatenate([self.term_positions(term_id) for term_id in term_ids]).astype(np.int64)
+        if len(term_ids) > 1:
+            positions.sort()
+        return positions
+
+    def phrase_positions(self, words):
+        """
+        Return the sorted start positions of every occurrence of the words as a consecutive
+        phrase within one video.
+
+        Intersects positional postings starting from the rarest word, so the cost depends on
+        the postings of the query words, not on the size of the corpus. Only the rarest word
+        is decoded in full; the other words are probed through their skip pointers, rarest
+        first, so a frequent word like "ja" only decodes the blocks near the candidates.
+        """
+        if not words:
+            return np.zeros(0, dtype=np.int64)
+        word_terms = [self.by_token.get(normalize_token(word), []) for word in words]
+        counts = [sum(self.postings.count(term_id) for term_id in term_ids) for term_ids in word_terms]
+        order = sorted(range(len(words)), key=lambda i: counts[i])
+        rarest = order[0]
+        starts = self.word_positions(words[rarest]) - rarest
+        starts = starts[starts >= 0]
+        for offset in order[1:]:
+            if starts.size == 0:
+                break
+            wanted = starts + offset
+            found = np.zeros(wanted.size, dtype=bool)
+            for term_id in word_terms[offset]:
+                found |= self.postings.contains(term_id, wanted)
+            starts = starts[found]
+        if len(words) > 1 and starts.size:
+            starts = starts[self.store.videos_of(starts) == self.store.videos_of(starts + len(words) - 1)]
+            if self.window is not None:
+                # The whole phrase must lie in one filter range; a video with unsorted
+                # timestamps can have several
+                window_starts, window_ends = self.window
+                ranges = np.searchsorted(window_starts, starts, side='right') - 1
+                inside = ranges >= 0
+                inside[inside] = starts[inside] + len(words) <= window_ends[ranges[inside]]
+                starts = starts[inside]
+        return starts
+
+    def near_spans(self, left_words, right_words, distance):
+        """
+        Return (span_starts, span_ends) where the right operand occurs at most distance
+        words after or before the left operand, in the same video. Each left occurrence
+        is paired with its nearest following right occurrence in its video, or else its
+        nearest preceding one.
+        """
+        left = self.phrase_positions(left_words)
+        right = self.phrase_positions(right_words)
+        if left.size == 0 or right.size == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        left_end = left + len(left_words) - 1
+        # Operands never cross a video boundary, so their first word tells their video
+        left_video = self.store.videos_of(left)
+        right_video = self.store.videos_of(right)
+
+        # Right operand after the left one: its start within distance words of the left end.
+        # The nearest one may already be in the next video; then there is none in this one.
+        after = np.searchsorted(right, left_end + 1)
+        after_ok = after < right.size
+        after_ok[after_ok] = (
+            (right[after[after_ok]] <= left_end[after_ok] + distance)
+            & (right_video[after[after_ok]] == left_video[after_ok])
+        )
+
+        # Right operand before the left one: its end within distance words of the left start
+        before = np.searchsorted(right, left - len(right_words), side='right') - 1
+        before_ok = before >= 0
+        before_ok[before_ok] = (
+            (right[before[before_ok]] + len(right_words) - 1 >= left[before_ok] - distance)
+            & (right_video[before[before_ok]] == left_video[before_ok])
+        )
+
+        span_starts = np.where(after_ok, left, right[np.clip(before, 0, None)])
+        span_ends = np.where(after_ok, right[np.clip(after, 0, right.size - 1)] + len(right_words) - 1, left_end)
+        keep = after_ok | before_ok
+        return span_starts[keep], span_ends[keep]
+
+    def spans_to_matches(self, span_starts, span_ends, similarity=100.0):
+        """
+        Build match_info dicts for word spans. matched_word holds the transcript text of the
+        span, and the timestamps run from the first word's start to the last word's end.
+        """
+        matches = []
+        for video, start, end in zip(
+            self.store.videos_of(span_starts).tolist(),
+            span_starts.tolist(),
+            span_ends.tolist()
+        ):
+            video_info = self.videos[video]
+            match_info = {
+                "video_id": video_info["youtube_id"],
+                "video_name": video_info["video_name"],
+                "matched_word": join_words(self.terms[token_id] for token_id in self.store.token_ids[start:end + 1].tolist()),
+                "start_time": int(self.store.start_ms[start]) / 1000,
+                "end_time": int(self.store.end_ms[end]) / 1000,
+                "similarity": similarity
+            }
+            if self.context_words:
+                match_info["context"] = self.context_text(video, start, end)
+            matches.append(match_info)
+        return matches
+
+    def phrase_search(self, query, top_k=None):
+        """
+        Phrase or NEAR/k proximity search from the positional postings.
+        See parse_phrase_query for the query syntax. Words match exactly, ignoring case and
+        surrounding punctuation. With top_k only the first top_k spans are built.
+        """
+        left_words, right_words, distance = parse_phrase_query(query)
+        if right_words is None:
+            span_starts = self.phrase_positions(left_words)
+            span_ends = span_starts + len(left_words) - 1
+        else:
+            span_starts, span_ends = self.near_spans(left_words, right_words, distance)
+        return self.spans_to_matches(span_starts[:top_k], span_ends[:top_k])
+
+    def expand_candidates(self, candidates, top_k=None):
+        """
+        Expand scored vocabulary words to match_info dicts.
+
+        Parameters:
+        - candidates (list): (vocabulary position, similarity) pairs.
+        - top_k (int): Only return the top_k best matches by similarity. All occurrences
+          of a word share its score, so words are expanded best-first and the expansion
+          stops as soon as top_k matches are collected: lower scoring words cannot enter.
+        """
+        matches = []
+        if top_k is None:
+            for position, similarity in candidates:
+                for term_id in self.vocabulary_terms[position]:
+                    matches.extend(self.expand_term(term_id, similarity))
+            return matches
+
+        for position, similarity in sorted(candidates, key=lambda candidate: -candidate[1]):
+            for term_id in self.vocabulary_terms[position]:
+                needed = top_k - len(matches)
+                if needed <= 0:
+                    return matches
+                matches.extend(self.positions_to_matches(self.term_positions(term_id, needed), similarity))
+        return matches
+
+    def fuzzy_search(self, search_word, threshold=80, top_k=None):
+        """
+        Fuzzy search over the vocabulary of distinct lowercased words.
+
+        Every distinct word is scored against the query exactly once with fuzz.ratio,
+        then the matching words are expanded to their occurrences through the postings.
+        Returns the same matches as scanning every transcript with the same threshold.
+        """
+        # Every vocabulary word occurs at least once, so top_k words always cover top_k matches,
+        # except in a filtered view, where a word may not occur inside the filter
+        limit = top_k if self.window is None else None
+        return self.expand_candidates(self.fuzzy_candidates(search_word, threshold, limit), top_k)
+
+    def fuzzy_candidates(self, search_word, threshold=80, limit=None):
+        """
+        Score the whole vocabulary and return (vocabulary position, similarity) pairs
+        at or above the threshold, or only the best limit of them.
+        """
+        candidates = process.extract(
+            search_word.lower(),
+            self.vocabulary,
+            scorer=fuzz.ratio,
+            score_cutoff=threshold,
+            limit=limit
+        )
+        return [(position, similarity) for _, similarity, position in candidates]
+
+    def batch_fuzzy_search(self, queries, threshold=80, block_size=256, workers=-1, top_k=None):
+        """
+        Fuzzy search many single-word queries in one vectorized pass over the vocabulary.
+
+        Queries are scored against the vocabulary in blocks with rapidfuzz cdist, so the
+        vocabulary is walked once per block instead of once per query and the scoring runs
+        on all cores. cdist works in float32, so candidates are rescored with fuzz.ratio to
+        keep exactly the same similarities and threshold semantics as fuzzy_search.
+
+        Yields (query, matches) in input order.
+        """
+        cutoff = max(threshold - 0.01, 0)
+        for block_start in range(0, len(queries), block_size):
+            block = queries[block_start:block_start + block_size]
+            lowered = [query.lower() for query in block]
+            scores = process.cdist(lowered, self.vocabulary, scorer=fuzz.ratio, score_cutoff=cutoff, workers=workers)
+            for row, query in enumerate(block):
+                if threshold <= 0:
+                    candidates = range(len(self.vocabulary))
+                else:
+                    candidates = np.flatnonzero(scores[row]).tolist()
+                scored = []
+                for position in candidates:
+                    similarity = fuzz.ratio(lowered[row], self.vocabulary[position])
+                    if similarity >= threshold:
+                        scored.append((position, similarity))
+                yield query, self.expand_candidates(scored, top_k)
+
+    def deletion_index(self, max_distance=2):
+        """
+        Return the deletion index for the vocabulary, opening or building it on first use.
+        It is persisted in the index folder for this build of the index, so only the first
+        symspell search after an index update pays for building it. An index already open
+        for a larger distance is returned instead, since it answers smaller ones too.
+        """
+        with self._deletion_lock:
+            larger = [distance for distance in self.deletion_indexes if distance >= max_distance]
+            if larger:
+                return self.deletion_indexes[min(larger)]
+            if self.index_folder is None:
+                deletion_index = DeletionIndex.build(self.vocabulary, max_distance)
+            else:
+                signature = f"{self.store.stat.st_size}:{self.store.stat.st_mtime_ns}"
+                deletion_index = DeletionIndex.load_or_build(self.vocabulary, self.index_folder, max_distance, signature)
+            self.deletion_indexes[max_distance] = deletion_index
+            return deletion_index
+
+    def symspell_search(self, search_word, threshold=80, max_distance=2, top_k=None):
+        """
+        Typo-tolerant search through the deletion index.
+
+        Candidates are the vocabulary words within max_distance edits of the query. They are
+        then scored with fuzz.ratio and filtered by the threshold like the other engines, so
+        the result is the subset of the fuzzy matches that are at most max_distance edits away.
+        """
+        return self.expand_candidates(self.symspell_candidates(search_word, threshold, max_distance), top_k)
+
+    def symspell_candidates(self, search_word, threshold=80, max_distance=2):
+        """
+        Return (vocabulary position, similarity) pairs of the words within max_distance
+        edits of the query that reach the threshold.
+        """
+        query = search_word.lower()
+        candidates = []
+        for position, _ in self.deletion_index(max_distance).lookup(query, max_distance):
+            similarity = fuzz.ratio(query, self.vocabulary[position])
+            if similarity >= threshold:
+                candidates.append((position, similarity))
+        return candidates
+
+    def bk_tree(self):
+        """
+        Return the BK-tree over the vocabulary, building it on first use.
+        """
+        if "bk_tree" not in self._structures:
+            self._structures["bk_tree"] = BKTree(self.vocabulary)
+        return self._structures["bk_tree"]
+
+    def prefix_index(self):
+        """
+        Return the autocomplete index over the vocabulary, building it on first use.
+        """
+        if "prefix_index" not in self._structures:
+            self._structures["prefix_index"] = PrefixIndex.from_index(self)
+        return self._structures["prefix_index"]
+
+    def ngram_index(self):
+        """
+        Return the n-gram index over the normalized words, building it on first use.
+        """
+        if "ngram_index" not in self._structures:
+            self._structures["ngram_index"] = NgramIndex(list(self.by_token))
+        return self._structures["ngram_index"]
+
+    def pattern_tokens(self, pattern, glob=False):
+        """
+        Return the normalized words that match a regex or glob pattern (see compile_pattern).
+
+        The pattern runs once per distinct word, never per occurrence, and only against the
+        words that contain the n-grams of its required literals. Raises ValueError for an
+        invalid pattern.
+        """
+        regex = compile_pattern(pattern, glob)
+        ngram_index = self.ngram_index()
+        positions = ngram_index.candidates(pattern_literals(pattern, glob))
+        words = ngram_index.words if positions is None else [ngram_index.words[position] for position in positions.tolist()]
+        match = regex.match if glob else regex.search
+        return [word for word in words if match(word)]
+
+    def pattern_search(self, pattern, glob=False, top_k=None):
+        """
+        Return match_info dicts for every occurrence of the words matching a regex or glob
+        pattern, or only the first top_k. Every match has similarity 100.
+        """
+        matches = []
+        for token in self.pattern_tokens(pattern, glob):
+            for term_id in self.by_token[token]:
+                if top_k is not None and len(matches) >= top_k:
+                    return matches
+                positions = self.term_positions(term_id, None if top_k is None else top_k - len(matches))
+                matches.extend(self.positions_to_matches(positions, 100.0))
+        return matches
+
+    def bktree_search(self, search_word, threshold=80, top_k=None):
+        """
+        Fuzzy search through the BK-tree. Returns the same matches as fuzzy_search
+        while only scoring the part of the vocabulary the tree cannot prune.
+        """
+        return self.expand_candidates(self.bktree_candidates(search_word, threshold), top_k)
+
+    def bktree_candidates(self, search_word, threshold=80):
+        """
+        Return (vocabulary position, similarity) pairs at or above the threshold,
+        visiting only the BK-tree nodes within the matching radius.
+        """
+        query = search_word.lower()
+        radius = ratio_radius(len(query), threshold)
+        if radius == float('inf'):
+            return self.fuzzy_candidates(search_word, threshold)
+        candidates = []
+        for position, _ in self.bk_tree().search(query, radius):
+            similarity = fuzz.ratio(query, self.vocabulary[position])
+            if similarity >= threshold:
+                candidates.append((position, similarity))
+        return candidates
+
+    def query_units(self, search_word, exact=False, threshold=80, engine="vocab", max_distance=2):
+        """
+        Resolve one query word into BM25 units: (positions, document frequency, similarity).
+
+        Exact lookups give the word's normalized form and the 'stem' engine gives its stem.
+        Fuzzy engines give one unit per normalized form of the matching words, weighted by
+        its best similarity, so "kahvia" and "Kahvia," count as one word in a video.
+        """
+        if engine == "stem" and not exact:
+            stem_id = self.stem_id(search_word)
+            if stem_id is None:
+                return []
+            return [(self.stem_positions(search_word), int(self.stem_df[stem_id]), 100.0)]
+
+        if exact:
+            scored_terms = [(term_id, 100.0) for term_id in self.by_token.get(normalize_token(search_word), [])]
+        elif engine in PATTERN_ENGINES:
+            scored_terms = [
+                (term_id, 100.0)
+                for token in self.pattern_tokens(search_word, engine == "glob")
+                for term_id in self.by_token[token]
+            ]
+        else:
+            if engine == "symspell":
+                candidates = self.symspell_candidates(search_word, threshold, max_distance)
+            elif engine == "bktree":
+                candidates = self.bktree_candidates(search_word, threshold)
+            else:
+                candidates = self.fuzzy_candidates(search_word, threshold)
+            scored_terms = [
+                (term_id, similarity)
+                for position, similarity in candidates
+                for term_id in self.vocabulary_terms[position]
+            ]
+
+        groups = {}
+        for term_id, similarity in scored_terms:
+            term_ids, best = groups.get(normalize_token(self.terms[term_id]), ([], 0.0))
+            term_ids.append(term_id)
+            groups[normalize_token(self.terms[term_id])] = (term_ids, max(best, similarity))
+        units = []
+        for term_ids, similarity in groups.values():
+            positions = np.concatenate([self.term_positions(term_id) for term_id in term_ids])
+            if positions.size:
+                units.append((positions, int(self.term_df[term_ids[0]]), similarity))
+        return units
+
+    def rank_videos(
+        self,
+        query,
+        exact=False,
+        threshold=80,
+        engine="vocab",
+        max_distance=2,
+        limit=10,
+        snippets=3,
+        k1=1.2,
+        b=0.75
+    ):
+        """
+        Rank videos by BM25 over the query words and return the best ones with their top hits.
+
+        Every query word is matched with the chosen engine (see query_units). Term frequencies
+        come from grouping its postings by video; document frequencies and video lengths were
+        stored at index time, so ranking costs O(postings of the matched words).
+
+        Returns a list of dicts, best first: rank, video_id, video_name, score, hits (number of
+        matched words in the video) and matches (up to snippets match_info dicts, the most
+        similar hits first, in time order).
+        """
+        words = [
+            word for word in query.replace('"', ' ').split()
+            if normalize_token(word) and not _NEAR_OPERATOR.fullmatch(f" {word} ")
+        ]
+        video_lengths = np.diff(self.store.video_offsets.astype(np.int64))
+        video_count = len(self.videos)
+        average_length = max(float(video_lengths.mean()), 1.0) if video_count else 1.0
+
+        scores = np.zeros(video_count)
+        hits = np.zeros(video_count, dtype=np.int64)
+        hit_positions = []
+        hit_similarities = []
+        for word in words:
+            for positions, df, similarity in self.query_units(word, exact, threshold, engine, max_distance):
+                videos, tf = np.unique(self.store.videos_of(positions), return_counts=True)
+                idf = np.log(1 + (video_count - df + 0.5) / (df + 0.5))
+                norm = k1 * (1 - b + b * video_lengths[videos] / average_length)
+                scores[videos] += similarity / 100 * idf * tf * (k1 + 1) / (tf + norm)
+                hits[videos] += tf
+                hit_positions.append(positions)
+                hit_similarities.append(np.full(positions.size, similarity))
+
+        ranked = np.flatnonzero(scores > 0)
+        ranked = ranked[np.argsort(-scores[ranked], kind='stable')][:limit]
+        if ranked.size == 0:
+            return []
+
+        positions = np.concatenate(hit_positions)
+        similarities = np.concatenate(hit_similarities)
+        videos = self.store.videos_of(positions)
+        keep = np.isin(videos, ranked)
+        positions, similarities, videos = positions[keep], similarities[keep], videos[keep]
+        # Group by video, best similarity first, earliest first among equals
+        order = np.lexsort((positions, -similarities, videos))
+        positions, similarities, videos = positions[order], similarities[order], videos[order]
+        starts = np.searchsorted(videos, ranked)
+        ends = np.searchsorted(videos, ranked, side='right')
+
+        results = []
+        for rank, video in enumerate(ranked.tolist(), start=1):
+            start = int(starts[rank - 1])
+            best = slice(start, min(start + snippets, int(ends[rank - 1])))
+            snippet_order = np.argsort(positions[best], kind='stable')
+            video_info = self.videos[video]
+            results.append({
+                "rank": rank,
+                "video_id": video_info["youtube_id"],
+                "video_name": video_info["video_name"],
+                "score": round(float(scores[video]), 4),
+                "hits": int(hits[video]),
+                "matches": self.positions_to_matches(
+                    positions[best][snippet_order],
+                    similarities[best][snippet_order].tolist()
+                )
+            })
+        return results
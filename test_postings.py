@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+from postings import BLOCK_SIZE, Postings, ranges_mask
+
+def random_postings(rng, term_count, max_count, span):
+    """
+    Build random CSR postings: offsets and the sorted positions of every term.
+    """
+    counts = rng.integers(0, max_count, term_count)
+    counts[::7] = rng.integers(0, 3)  # Empty terms and terms shorter than a block
+    offsets = np.zeros(term_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    positions = [np.sort(rng.choice(span, count, replace=False)) for count in counts]
+    return offsets, np.concatenate(positions + [np.zeros(0, dtype=np.int64)]).astype(np.uint32)
+
+class PostingsRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def check_round_trip(self, offsets, positions, postings):
+        for term_id in range(len(offsets) - 1):
+            expected = positions[offsets[term_id]:offsets[term_id + 1]]
+            self.assertEqual(postings.count(term_id), expected.size)
+            np.testing.assert_array_equal(postings.positions(term_id), expected)
+            for limit in (0, 1, BLOCK_SIZE, BLOCK_SIZE + 1):
+                np.testing.assert_array_equal(postings.positions(term_id, limit), expected[:limit])
+
+    def test_round_trip(self):
+        # Small spans give narrow gaps, 2 ** 32 gives blocks up to 32 bits wide
+        for span in (1000, 10 ** 6, 2 ** 32):
+            offsets, positions = random_postings(self.rng, 60, 600, span)
+            self.check_round_trip(offsets, positions, Postings.encode(offsets, positions))
+
+    def test_round_trip_across_batches(self):
+        offsets, positions = random_postings(self.rng, 40, 1000, 10 ** 5)
+        batch_blocks = Postings.ENCODE_BATCH_BLOCKS
+        try:
+            Postings.ENCODE_BATCH_BLOCKS = 3
+            postings = Postings.encode(offsets, positions)
+        finally:
+            Postings.ENCODE_BATCH_BLOCKS = batch_blocks
+        self.check_round_trip(offsets, positions, postings)
+        reference = Postings.encode(offsets, positions)
+        for name in Postings.ARRAYS:
+            np.testing.assert_array_equal(getattr(postings, name), getattr(reference, name))
+
+    def test_contains(self):
+        offsets, positions = random_postings(self.rng, 30, 2000, 10 ** 5)
+        postings = Postings.encode(offsets, positions)
+        for term_id in range(len(offsets) - 1):
+            expected = positions[offsets[term_id]:offsets[term_id + 1]]
+            # Few probes decode single blocks, many probes decode the whole term
+            for size in (5, 50, 5000):
+                wanted = np.unique(self.rng.integers(0, 10 ** 5, size))
+                np.testing.assert_array_equal(postings.contains(term_id, wanted), np.isin(wanted, expected))
+
+    def test_positions_in(self):
+        offsets, positions = random_postings(self.rng, 30, 2000, 10 ** 5)
+        postings = Postings.encode(offsets, positions)
+        bounds = np.unique(self.rng.integers(0, 10 ** 5, 40))
+        starts, ends = bounds[0::2][:len(bounds) // 2], bounds[1::2]
+        inside = ranges_mask(positions, starts, ends)
+        for term_id in range(len(offsets) - 1):
+            term = slice(offsets[term_id], offsets[term_id + 1])
+            np.testing.assert_array_equal(postings.positions_in(term_id, starts, ends), positions[term][inside[term]])
+            self.assertEqual(postings.positions_in(term_id, starts[:0], ends[:0]).size, 0)
+
+    def assert_same(self, postings, expected):
+        for name in Postings.ARRAYS:
+            np.testing.assert_array_equal(getattr(postings, name), getattr(expected, name), err_msg=name)
+
+    def test_select_and_concatenate(self):
+        offsets, positions = random_postings(self.rng, 40, 700, 10 ** 5)
+        postings = Postings.encode(offsets, positions)
+        term_ids = self.rng.permutation(40)[:25]
+        selected_offsets, selected = postings.decode_terms(term_ids)
+        self.assert_same(postings.select(term_ids), Postings.encode(selected_offsets, selected))
+        self.assert_same(Postings.concatenate([postings.select(term_ids[:10]), postings.select(term_ids[10:])]), postings.select(term_ids))
+
+    def test_head_followed_by_rest(self):
+        offsets, positions = random_postings(self.rng, 40, 700, 10 ** 5)
+        postings = Postings.encode(offsets, positions)
+        term_ids = np.arange(40)
+        head_blocks = np.maximum(np.diff(postings.blocks.astype(np.int64)) - 1, 0)
+        rest_offsets, rest = postings.decode_terms(term_ids, head_blocks)
+        joined = Postings.concatenate([postings.head(term_ids, head_blocks), Postings.encode(rest_offsets, rest.astype(np.uint32))])
+        self.assert_same(joined.select(term_ids, term_ids + 40), postings)
+
+    def test_shifted(self):
+        offsets, positions = random_postings(self.rng, 40, 700, 10 ** 5)
+        bounds = np.unique(self.rng.integers(0, 10 ** 5, 20))
+        starts, ends = bounds[0::2][:len(bounds) // 2], bounds[1::2]
+        outside = ~ranges_mask(positions, starts, ends)
+        counts = [np.count_nonzero(outside[offsets[t]:offsets[t + 1]]) for t in range(40)]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        positions = positions[outside].astype(np.int64)
+        removed = np.concatenate([[0], np.cumsum(ends - starts)])[np.searchsorted(ends, positions, side='right')]
+        expected = Postings.encode(offsets, (positions - removed).astype(np.uint32))
+        self.assert_same(Postings.encode(offsets, positions.astype(np.uint32)).shifted(starts, ends), expected)
+
+    def test_arrays(self):
+        offsets, positions = random_postings(self.rng, 10, 300, 1000)
+        postings = Postings.from_arrays(Postings.encode(offsets, positions).arrays("postings_"), "postings_")
+        self.check_round_trip(offsets, positions, postings)
+
+    def test_empty(self):
+        postings = Postings.encode(np.zeros(3, dtype=np.int64), np.zeros(0, dtype=np.uint32))
+        self.assertEqual(len(postings), 2)
+        self.assertEqual(postings.positions(1).size, 0)
+        self.assertFalse(postings.contains(0, np.array([1, 2])).any())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import tempfile
+import random
+import unittest
+import numpy as np
+from search_index import FILE_TERMS_FILE, INDEX_FILE, TranscriptIndex, build_index, load_manifest, stem_segment, write_file_terms, write_index
+from transcript_store import StoreFile, TranscriptStore, load_segment
+from transcripts import SearchFilter
+
+def write_transcript(output_folder, file_name, words):
+    """
+    Write a transcription JSON file with one word per second.
+    """
+    with open(os.path.join(output_folder, file_name), 'w', encoding='utf-8') as f:
+        json.dump({"words": [{"word": word, "start": i, "end": i + 0.5} for i, word in enumerate(words)]}, f)
+
+class NearSpansTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.folder, "output")
+        os.makedirs(self.output_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load_index(self, transcripts):
+        for file_name, words in transcripts.items():
+            write_transcript(self.output_folder, file_name, words)
+        index_folder = os.path.join(self.folder, "index")
+        build_index(self.output_folder, index_folder, workers=1)
+        return TranscriptIndex.load(index_folder)
+
+    def test_right_operand_at_start_of_next_video(self):
+        # The nearest "joulua" after the last "kahvia" of the first video opens the second
+        # video; the one two words before it in the same video must still pair with it
+        index = self.load_index({
+            "1200000000_20120101_aaaaaaaaaaa_First.json": ["joulua", "ja", "kahvia"],
+            "1200000001_20120102_bbbbbbbbbbb_Second.json": ["joulua", "on", "se"],
+        })
+        matches = index.phrase_search("kahvia NEAR/3 joulua")
+        self.assertEqual([(m["video_id"], m["matched_word"]) for m in matches], [("aaaaaaaaaaa", "joulua ja kahvia")])
+
+    def test_right_operand_at_end_of_previous_video(self):
+        index = self.load_index({
+            "1200000000_20120101_aaaaaaaaaaa_First.json": ["se", "on", "joulua"],
+            "1200000001_20120102_bbbbbbbbbbb_Second.json": ["kahvia", "ja", "joulua"],
+        })
+        matches = index.phrase_search("kahvia NEAR/3 joulua")
+        self.assertEqual([(m["video_id"], m["matched_word"]) for m in matches], [("bbbbbbbbbbb", "kahvia ja joulua")])
+
+    def test_no_match_across_videos(self):
+        index = self.load_index({
+            "1200000000_20120101_aaaaaaaaaaa_First.json": ["se", "on", "kahvia"],
+            "1200000001_20120102_bbbbbbbbbbb_Second.json": ["joulua", "on", "se"],
+        })
+        self.assertEqual(index.phrase_search("kahvia NEAR/3 joulua"), [])
+
+class TimeWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.folder, "output")
+        os.makedirs(self.output_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_unsorted_timestamps(self):
+        # Whisper can emit a word that starts before the one ahead of it
+        words = ["kahvia", "ja", "kahvia", "on", "kahvia", "ja"]
+        starts = [10, 2, 3, 12, 13, 14]
+        with open(os.path.join(self.output_folder, "1200000000_20120101_aaaaaaaaaaa_First.json"), 'w', encoding='utf-8') as f:
+            json.dump({"words": [{"word": w, "start": t, "end": t + 0.5} for w, t in zip(words, starts)]}, f)
+        write_transcript(self.output_folder, "1200000001_20120102_bbbbbbbbbbb_Second.json", ["kahvia", "ja"] * 10)
+        index_folder = os.path.join(self.folder, "index")
+        build_index(self.output_folder, index_folder, workers=1)
+        index = TranscriptIndex.load(index_folder)
+        np.testing.assert_array_equal(index.store.unsorted_videos, [0])
+
+        view = index.filtered(SearchFilter(start_ms=5000, end_ms=14000))
+        self.assertEqual(
+            [(m["video_id"], m["start_time"]) for m in view.exact_search("kahvia")],
+            [("aaaaaaaaaaa", 10), ("aaaaaaaaaaa", 13), ("bbbbbbbbbbb", 6), ("bbbbbbbbbbb", 8), ("bbbbbbbbbbb", 10), ("bbbbbbbbbbb", 12)]
+        )
+        # "kahvia ja" at 10 s runs into a word at 2 s, outside the window
+        self.assertEqual(
+            [(m["video_id"], m["start_time"]) for m in view.phrase_search("kahvia ja")],
+            [("bbbbbbbbbbb", 6), ("bbbbbbbbbbb", 8), ("bbbbbbbbbbb", 10), ("bbbbbbbbbbb", 12)]
+        )
+
+class UpdateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.folder, "output")
+        self.index_folder = os.path.join(self.folder, "index")
+        os.makedirs(self.output_folder)
+        self.rng = random.Random(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def words(self, count):
+        # Frequent words span many postings blocks, rare ones and case variants only a few
+        common = ["ja", "on", "se", "joulua", "kahvia"]
+        rare = ["Kahvia,", "KAHVIA", "joulu", "odotellessa", "tusin", "sana", str(self.rng.randint(0, 50))]
+        return [self.rng.choice(common if self.rng.random() < 0.8 else rare) for _ in range(count)]
+
+    def file_name(self, number):
+        return f"12000000{number:02d}_20120101_{chr(97 + number) * 11}_Video.json"
+
+    def assert_matches_full_write(self):
+        # The updated index must equal the index written from scratch for its own token stream
+        store = TranscriptStore(os.path.join(self.index_folder, INDEX_FILE))
+        segment = load_segment(store)
+        store.close()
+        expected_folder = os.path.join(self.folder, "expected")
+        write_index(expected_folder, self.output_folder, stem_segment(segment))
+        write_file_terms(expected_folder, segment, load_manifest(self.index_folder)["files"])
+        for file_name in (INDEX_FILE, FILE_TERMS_FILE):
+            updated = StoreFile(os.path.join(self.index_folder, file_name))
+            expected = StoreFile(os.path.join(expected_folder, file_name))
+            self.assertEqual(updated.header, expected.header)
+            self.assertEqual(sorted(updated.arrays), sorted(expected.arrays))
+            for name, array in expected.arrays.items():
+                np.testing.assert_array_equal(updated.arrays[name], array, err_msg=f"{file_name}: {name}")
+            updated.close()
+            expected.close()
+
+    def test_update_matches_full_write(self):
+        for number in range(6):
+            write_transcript(self.output_folder, self.file_name(number), self.words(400))
+        build_index(self.output_folder, self.index_folder, workers=1)
+
+        # Add, change and delete, then only add
+        os.remove(os.path.join(self.output_folder, self.file_name(2)))
+        write_transcript(self.output_folder, self.file_name(4), self.words(300))
+        write_transcript(self.output_folder, self.file_name(6), self.words(500))
+        build_index(self.output_folder, self.index_folder, workers=1)
+        self.assert_matches_full_write()
+
+        write_transcript(self.output_folder, self.file_name(7), self.words(200))
+        build_index(self.output_folder, self.index_folder, workers=1)
+        self.assert_matches_full_write()
+
+    def test_update_to_empty(self):
+        write_transcript(self.output_folder, self.file_name(0), self.words(10))
+        build_index(self.output_folder, self.index_folder, workers=1)
+        os.remove(os.path.join(self.output_folder, self.file_name(0)))
+        build_index(self.output_folder, self.index_folder, workers=1)
+        self.assert_matches_full_write()
+
+if __name__ == "__main__":
+    unittest.main()
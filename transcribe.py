@@ -68,7 +68,7 @@ def transcribe_file(
         json_name = os.path.splitext(mp3_filename)[0] + ".json"
         json_path = os.path.join(output_folder, json_name)
         with open(json_path, "w", encoding="utf-8") as out_f:
-            json.dump(transcription_data, out_f, ensure_ascii=False, indent=2)
+            json.dump(transcription_data, out_f, ensure_ascii=False, separators=(",", ":"))
 
         # Update progress/tracker
         save_progress(progress_file, mp3_filename)
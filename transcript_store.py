@@ -0,0 +1,491 @@
+import os
+import sys
+import json
+import mmap
+import array
+import heapq
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
+from transcripts import extract_video_info, in_date_range, list_transcripts, read_transcript_words
+
+STORE_MAGIC = b"N22STORE"
+STORE_VERSION = 1
+STORE_ALIGNMENT = 64
+# The search index lives in index/corpus.bin; a plain store must never overwrite it
+DEFAULT_STORE_PATH = os.path.join("index", "transcripts.bin")
+# Default transcript JSON bytes read into one segment by a worker of read_transcripts_sharded
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Columnar transcripts held in memory: the unit that is read, merged and written as a store
+Segment = namedtuple("Segment", ["videos", "vocabulary", "token_ids", "start_ms", "end_ms", "video_offsets"])
+
+# magic, version, header length
+_PREAMBLE = struct.Struct("<8sIQ")
+
+def _align(offset):
+    return (offset + STORE_ALIGNMENT - 1) // STORE_ALIGNMENT * STORE_ALIGNMENT
+
+def encode_strings(strings):
+    """
+    Encode a list of strings as a string table: (offsets, utf-8 bytes).
+    String i is bytes[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    if encoded:
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+def decode_strings(offsets, data):
+    """
+    Decode a string table written by encode_strings.
+    """
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return [raw[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)]
+
+def write_store(path, header, arrays):
+    """
+    Write a store file: a JSON header followed by 64-byte aligned little-endian arrays.
+
+    Parameters:
+    - path (str): Destination file. Written to a temporary file and renamed into place.
+    - header (dict): JSON-serializable metadata, stored as-is.
+    - arrays (dict): Mapping of array name to NumPy array.
+    """
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        layout[name] = {"dtype": values.dtype.newbyteorder('<').str, "offset": offset, "count": int(values.size)}
+        offset = _align(offset + values.nbytes)
+
+    header = dict(header, arrays=layout)
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    # One temporary file per process, so two processes writing the same store never collide
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(STORE_MAGIC, STORE_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, values in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(values).astype(layout[name]["dtype"], copy=False).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+class StoreFile:
+    """
+    Memory-mapped store file. Arrays are zero-copy NumPy views into the mapping,
+    so opening a store costs the same no matter how large it is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Size and mtime of the file that was mapped, even if it is replaced later
+            self.stat = os.fstat(f.fileno())
+        if len(self._mmap) < _PREAMBLE.size:
+            magic = version = header_length = None
+        else:
+            magic, version, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            self._mmap.close()
+            raise ValueError(f"'{path}' is not a transcript store, rebuild it with 'python search.py index'.")
+        self.header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length].decode('utf-8'))
+        data_start = _align(_PREAMBLE.size + header_length)
+
+        self.arrays = {}
+        for name, spec in self.header["arrays"].items():
+            self.arrays[name] = np.frombuffer(
+                self._mmap,
+                dtype=np.dtype(spec["dtype"]),
+                count=spec["count"],
+                offset=data_start + spec["offset"]
+            )
+
+    def close(self):
+        """
+        Drop the array views. The mapping itself is unmapped once no NumPy view
+        (including ones handed out to callers) refers to it any more.
+        """
+        self.arrays = {}
+        self._mmap = None
+
+class TranscriptStore(StoreFile):
+    """
+    Columnar binary transcript store.
+
+    All transcripts are concatenated into one token stream:
+    - vocabulary: string table of distinct words, sorted, addressed by token id
+    - token_ids: uint32 token id of every word occurrence
+    - start_ms / end_ms: uint32 word timestamps in milliseconds
+    - video_offsets: video i owns token positions video_offsets[i]:video_offsets[i + 1]
+    - unsorted_videos: ids of the videos whose start_ms go backwards somewhere
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.videos = self.header["videos"]
+        self.token_ids = self.arrays["token_ids"]
+        self.start_ms = self.arrays["start_ms"]
+        self.end_ms = self.arrays["end_ms"]
+        self.video_offsets = self.arrays["video_offsets"]
+        self._vocabulary = None
+        # Stores written before the array was recorded are checked on first use
+        self._unsorted_videos = self.arrays.get("unsorted_videos")
+
+    def close(self):
+        self.token_ids = self.start_ms = self.end_ms = self.video_offsets = self._unsorted_videos = None
+        super().close()
+
+    @property
+    def unsorted_videos(self):
+        """
+        Sorted ids of the videos whose word start times are not non-decreasing.
+        """
+        if self._unsorted_videos is None:
+            self._unsorted_videos = find_unsorted_videos(self.start_ms, self.video_offsets)
+        return self._unsorted_videos
+
+    @property
+    def vocabulary(self):
+        """
+        The decoded list of distinct words, indexed by token id.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = decode_strings(self.arrays["vocab_offsets"], self.arrays["vocab_bytes"])
+        return self._vocabulary
+
+    def word(self, token_id):
+        """
+        Decode a single word from the string table without decoding the whole vocabulary.
+        """
+        offsets = self.arrays["vocab_offsets"]
+        return self.arrays["vocab_bytes"][int(offsets[token_id]):int(offsets[token_id + 1])].tobytes().decode('utf-8')
+
+    @property
+    def word_count(self):
+        return int(self.token_ids.size)
+
+    def video_range(self, video):
+        """
+        Return the (start, end) token positions of a video.
+        """
+        return int(self.video_offsets[video]), int(self.video_offsets[video + 1])
+
+    def video_words(self, video):
+        """
+        Return the words of a video as a list of strings.
+        """
+        start, end = self.video_range(video)
+        vocabulary = self.vocabulary
+        return [vocabulary[token_id] for token_id in self.token_ids[start:end].tolist()]
+
+    def window_ranges(self, search_filter=None):
+        """
+        Return the sorted (start, end) token positions of every video inside the filter's
+        date range, narrowed to the words starting inside its time window. Without a
+        filter, every non-empty video is returned whole.
+
+        Word timestamps are almost always non-decreasing within a video, so the window is
+        found by binary search and the cost depends on the number of videos, not words.
+        In the videos recorded as unsorted when the store was written, every word is
+        checked instead, and the words inside the window can form several ranges.
+        """
+        ranges = []
+        timed = search_filter is not None and (search_filter.start_ms is not None or search_filter.end_ms is not None)
+        unsorted = set(self.unsorted_videos.tolist()) if timed else set()
+        for video, video_info in enumerate(self.videos):
+            if search_filter is not None and not in_date_range(video_info["file_name"], search_filter):
+                continue
+            video_start, video_end = self.video_range(video)
+            if video in unsorted:
+                ranges.extend(window_runs(self.start_ms[video_start:video_end], search_filter, video_start))
+                continue
+            start, end = video_start, video_end
+            if search_filter is not None and search_filter.start_ms is not None:
+                start = video_start + int(np.searchsorted(self.start_ms[video_start:video_end], search_filter.start_ms))
+            if search_filter is not None and search_filter.end_ms is not None:
+                end = video_start + int(np.searchsorted(self.start_ms[video_start:video_end], search_filter.end_ms))
+            if end > start:
+                ranges.append((start, end))
+        return ranges
+
+    def videos_of(self, positions):
+        """
+        Map token positions to the videos that contain them.
+        """
+        return np.searchsorted(self.video_offsets, positions, side='right') - 1
+
+def find_unsorted_videos(start_ms, video_offsets):
+    """
+    Return the sorted ids of the videos in which a word starts before the word ahead of it.
+    """
+    offsets = video_offsets.astype(np.int64)
+    backwards = np.flatnonzero(start_ms[1:] < start_ms[:-1]) + 1
+    videos = np.searchsorted(offsets, backwards, side='right') - 1
+    # A video starting earlier than the previous one ends is fine
+    return np.unique(videos[backwards != offsets[videos]]).astype(np.uint32)
+
+def window_runs(start_ms, search_filter, offset=0):
+    """
+    Return the (start, end) runs of consecutive words, numbered from offset, that start
+    inside the filter's time window, checking every word.
+    """
+    inside = np.ones(len(start_ms), dtype=bool)
+    if search_filter.start_ms is not None:
+        inside &= start_ms >= search_filter.start_ms
+    if search_filter.end_ms is not None:
+        inside &= start_ms < search_filter.end_ms
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], inside, [False])).astype(np.int8)))
+    return [(offset + start, offset + end) for start, end in edges.reshape(-1, 2).tolist()]
+
+def seconds_to_ms(seconds):
+    """
+    Convert a timestamp in seconds to whole milliseconds.
+    """
+    return max(0, int(round((seconds or 0) * 1000)))
+
+def read_transcripts(output_folder, json_files=None, progress=True):
+    """
+    Read transcription JSON files into a Segment with a sorted vocabulary.
+    Files that search.py would skip (invalid filename format or invalid JSON) are skipped here too.
+
+    Parameters:
+    - output_folder (str): Path to the folder containing transcription JSON files.
+    - json_files (list): Filenames to read. Defaults to every JSON file in the folder.
+    - progress (bool): Show a progress bar.
+    """
+    if json_files is None:
+        json_files = list_transcripts(output_folder)
+
+    videos = []
+    token_of = {}
+    token_ids = array.array('I')
+    start_ms = array.array('I')
+    end_ms = array.array('I')
+    video_offsets = [0]
+
+    for json_file in tqdm(json_files, desc="Reading transcripts", unit="file", disable=not progress):
+        youtube_id, video_name = extract_video_info(json_file)
+        if not youtube_id or not video_name:
+            continue
+
+        transcript = read_transcript_words(os.path.join(output_folder, json_file))
+        if transcript is None:
+            continue
+
+        videos.append({"file_name": json_file, "youtube_id": youtube_id, "video_name": video_name})
+        for word in transcript.words:
+            token_id = token_of.get(word)
+            if token_id is None:
+                token_id = token_of[word] = len(token_of)
+            token_ids.append(token_id)
+        start_ms.extend(seconds_to_ms(start) for start in transcript.starts)
+        end_ms.extend(seconds_to_ms(end) for end in transcript.ends)
+        video_offsets.append(len(token_ids))
+
+    # Renumber tokens so the vocabulary is sorted
+    vocabulary = sorted(token_of)
+    remap = np.empty(len(token_of), dtype=np.uint32)
+    for new_id, word in enumerate(vocabulary):
+        remap[token_of[word]] = new_id
+    token_ids = remap[np.frombuffer(token_ids, dtype=np.uint32)] if token_ids else np.zeros(0, dtype=np.uint32)
+
+    return Segment(
+        videos,
+        vocabulary,
+        token_ids,
+        np.frombuffer(start_ms, dtype=np.uint32).copy(),
+        np.frombuffer(end_ms, dtype=np.uint32).copy(),
+        np.array(video_offsets, dtype=np.uint64)
+    )
+
+def shard_transcripts(output_folder, json_files, segment_bytes=SEGMENT_BYTES):
+    """
+    Cut the files, in order, into shards of at most segment_bytes of transcript JSON.
+    A file larger than segment_bytes gets a shard of its own.
+    """
+    shards = []
+    shard = []
+    shard_bytes = 0
+    for json_file in json_files:
+        size = os.path.getsize(os.path.join(output_folder, json_file))
+        if shard and shard_bytes + size > segment_bytes:
+            shards.append(shard)
+            shard = []
+            shard_bytes = 0
+        shard.append(json_file)
+        shard_bytes += size
+    if shard:
+        shards.append(shard)
+    return shards
+
+def _read_shard(output_folder, json_files, progress=False):
+    return read_transcripts(output_folder, json_files, progress)
+
+def map_shards(output_folder, json_files, read_shard, workers=None, segment_bytes=SEGMENT_BYTES):
+    """
+    Cut the files into shards (see shard_transcripts) and call read_shard(output_folder, shard,
+    progress=False) on every shard with a process pool. Returns the results in file order.
+    With one worker or one shard, read_shard runs once in this process on all the files,
+    with its own progress bar.
+
+    Parameters:
+    - output_folder (str): Path to the folder containing transcription JSON files.
+    - json_files (list): Filenames to read.
+    - read_shard (callable): Picklable module-level function run in the workers.
+    - workers (int): Number of worker processes. None defaults to CPU core count.
+    - segment_bytes (int): Maximum transcript JSON bytes per shard.
+    """
+    workers = workers or os.cpu_count()
+    shards = shard_transcripts(output_folder, json_files, segment_bytes)
+    if workers == 1 or len(shards) <= 1:
+        return [read_shard(output_folder, json_files, True)]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        return list(tqdm(
+            executor.map(read_shard, [output_folder] * len(shards), shards, [False] * len(shards)),
+            total=len(shards),
+            desc="Reading transcripts",
+            unit="segment"
+        ))
+
+def read_transcripts_sharded(output_folder, json_files=None, workers=None, segment_bytes=SEGMENT_BYTES):
+    """
+    Read transcription JSON files like read_transcripts, with a process pool.
+
+    The files are cut into shards of at most segment_bytes (see shard_transcripts), which
+    bounds the memory a worker needs for its segment. Every worker decodes its shards into
+    local segments with their own sorted vocabularies, and the segments are combined in file
+    order with the k-way vocabulary merge of merge_segments, so the result is the same
+    Segment a single read_transcripts call would return.
+
+    Parameters:
+    - output_folder (str): Path to the folder containing transcription JSON files.
+    - json_files (list): Filenames to read. Defaults to every JSON file in the folder.
+    - workers (int): Number of worker processes. None defaults to CPU core count.
+    - segment_bytes (int): Maximum transcript JSON bytes per shard.
+    """
+    if json_files is None:
+        json_files = list_transcripts(output_folder)
+    return merge_segments(map_shards(output_folder, json_files, _read_shard, workers, segment_bytes))
+
+def load_segment(store):
+    """
+    Copy a store's transcripts into an in-memory Segment, so the store file can be
+    replaced afterwards.
+    """
+    return Segment(
+        list(store.videos),
+        list(store.vocabulary),
+        store.token_ids.copy(),
+        store.start_ms.copy(),
+        store.end_ms.copy(),
+        store.video_offsets.copy()
+    )
+
+def drop_videos(segment, file_names):
+    """
+    Return the segment without the videos read from the given transcript files.
+    Words that no longer occur anywhere are removed from the vocabulary.
+    """
+    keep = [i for i, video in enumerate(segment.videos) if video["file_name"] not in file_names]
+    if len(keep) == len(segment.videos):
+        return segment
+
+    offsets = segment.video_offsets.astype(np.int64)
+    lengths = offsets[1:] - offsets[:-1]
+    mask = np.repeat(np.isin(np.arange(len(segment.videos)), keep), lengths)
+    video_offsets = np.zeros(len(keep) + 1, dtype=np.uint64)
+    np.cumsum(lengths[keep], out=video_offsets[1:])
+    token_ids = segment.token_ids[mask]
+    used = np.bincount(token_ids, minlength=len(segment.vocabulary)) > 0
+    remap = (np.cumsum(used) - 1).astype(np.uint32)
+    return Segment(
+        [segment.videos[i] for i in keep],
+        [segment.vocabulary[token_id] for token_id in np.flatnonzero(used).tolist()],
+        remap[token_ids],
+        segment.start_ms[mask],
+        segment.end_ms[mask],
+        video_offsets
+    )
+
+def merge_vocabularies(vocabularies):
+    """
+    Merge sorted vocabularies with a k-way merge. Returns (vocabulary, remaps) where
+    remaps[i] maps the ids of vocabularies[i] to ids in the merged vocabulary.
+    """
+    vocabulary = []
+    for word in heapq.merge(*vocabularies):
+        if not vocabulary or vocabulary[-1] != word:
+            vocabulary.append(word)
+    position = {word: i for i, word in enumerate(vocabulary)}
+    remaps = [np.array([position[word] for word in words], dtype=np.uint32) for words in vocabularies]
+    return vocabulary, remaps
+
+def merge_segments(segments, merged=None):
+    """
+    Merge segments into one, in order. The sorted vocabularies are combined with a
+    k-way merge and every segment's token ids are remapped into the merged vocabulary.
+    merged is the result of merge_vocabularies on the segment vocabularies, if the
+    caller already has it.
+    """
+    vocabulary, remaps = merged or merge_vocabularies([segment.vocabulary for segment in segments])
+
+    videos = []
+    token_ids = []
+    video_offsets = [np.zeros(1, dtype=np.uint64)]
+    total = 0
+    for segment, remap in zip(segments, remaps):
+        token_ids.append(remap[segment.token_ids] if segment.token_ids.size else segment.token_ids)
+        videos.extend(segment.videos)
+        video_offsets.append(segment.video_offsets[1:].astype(np.uint64) + np.uint64(total))
+        total += int(segment.token_ids.size)
+
+    return Segment(
+        videos,
+        vocabulary,
+        np.concatenate(token_ids).astype(np.uint32, copy=False) if token_ids else np.zeros(0, dtype=np.uint32),
+        np.concatenate([segment.start_ms for segment in segments]) if segments else np.zeros(0, dtype=np.uint32),
+        np.concatenate([segment.end_ms for segment in segments]) if segments else np.zeros(0, dtype=np.uint32),
+        np.concatenate(video_offsets)
+    )
+
+def store_arrays(segment):
+    """
+    Return the arrays of a transcript store for a segment, ready for write_store.
+    """
+    vocab_offsets, vocab_bytes = encode_strings(segment.vocabulary)
+    return {
+        "vocab_offsets": vocab_offsets,
+        "vocab_bytes": vocab_bytes,
+        "token_ids": segment.token_ids.astype(np.uint32, copy=False),
+        "start_ms": segment.start_ms.astype(np.uint32, copy=False),
+        "end_ms": segment.end_ms.astype(np.uint32, copy=False),
+        "video_offsets": segment.video_offsets.astype(np.uint64, copy=False),
+        "unsorted_videos": find_unsorted_videos(segment.start_ms, segment.video_offsets)
+    }
+
+def convert_transcripts(output_folder='output', store_path=DEFAULT_STORE_PATH):
+    """
+    Convert all transcription JSON files in the output folder into a single transcript store.
+    """
+    segment = read_transcripts(output_folder)
+    os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+    write_store(store_path, {"kind": "transcripts", "videos": segment.videos}, store_arrays(segment))
+    print(
+        f"Stored {len(segment.videos)} videos, {segment.token_ids.size} words and "
+        f"{len(segment.vocabulary)} distinct words in '{store_path}'."
+    )
+    return store_path
+
+if __name__ == "__main__":
+    # Usage: python transcript_store.py [output_folder] [store_path]
+    convert_transcripts(*sys.argv[1:3])
@@ -0,0 +1,200 @@
+import os
+import json
+from collections import namedtuple
+
+# Faster JSON decoders are optional; the stdlib json module is the fallback
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Restricts a search to videos uploaded between from_date and to_date (inclusive YYYYMMDD
+# strings) and to words starting in [start_ms, end_ms) of each video. None means unbounded.
+SearchFilter = namedtuple("SearchFilter", ["from_date", "to_date", "start_ms", "end_ms"], defaults=(None, None, None, None))
+
+# Columns of one transcript: the words and their start and end times in seconds
+TranscriptWords = namedtuple("TranscriptWords", ["words", "starts", "ends"])
+
+if msgspec is not None:
+    class WordStruct(msgspec.Struct):
+        word: str = ''
+        start: float = 0.0
+        end: float = 0.0
+
+    class TranscriptStruct(msgspec.Struct):
+        words: list[WordStruct] = []
+
+    _transcript_decoder = msgspec.json.Decoder(TranscriptStruct)
+
+# Decoders read_transcript_words can use, fastest first
+JSON_DECODERS = [name for name, module in (("msgspec", msgspec), ("orjson", orjson)) if module is not None] + ["json"]
+
+def loads(data):
+    """
+    Decode JSON bytes with orjson when it is installed, otherwise with the stdlib.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def decode_transcript(data, decoder=None):
+    """
+    Decode the bytes of a transcription JSON file into TranscriptWords columns.
+
+    msgspec decodes straight into typed structs without building a dict per word; orjson
+    and the stdlib build dicts that are then split into columns. Raises ValueError for
+    invalid JSON.
+
+    Parameters:
+    - data (bytes): Content of the transcription file.
+    - decoder (str): 'msgspec', 'orjson' or 'json'. Defaults to the fastest installed one.
+    """
+    decoder = decoder or JSON_DECODERS[0]
+    if decoder == "msgspec":
+        try:
+            words = _transcript_decoder.decode(data).words
+            return TranscriptWords(
+                [w.word for w in words],
+                [w.start for w in words],
+                [w.end for w in words]
+            )
+        except msgspec.ValidationError:
+            pass  # Valid JSON with unexpected types, such as null timestamps: decode it loosely
+    data = json.loads(data) if decoder == "json" else loads(data)
+    words = data.get('words', [])
+    return TranscriptWords(
+        [w.get('word', '') for w in words],
+        [w.get('start', 0) for w in words],
+        [w.get('end', 0) for w in words]
+    )
+
+def read_transcript_words(json_path, decoder=None):
+    """
+    Read a transcription JSON file into TranscriptWords columns.
+    Returns None if the file is not valid JSON.
+    """
+    with open(json_path, 'rb') as f:
+        data = f.read()
+    try:
+        return decode_transcript(data, decoder)
+    except ValueError:
+        return None
+
+def join_words(words):
+    """
+    Join transcript words into display text. Whisper words carry their own leading
+    spaces, so every word is stripped and joined with single spaces.
+    """
+    return " ".join(word.strip() for word in words if word.strip())
+
+def extract_video_info(filename):
+    """
+    Extract youtube_id and video_name from the filename.
+    Expected filename formats:
+    - unixtimestamp_uploaddate_videoid_videoname.json
+    - unixtimestamp_uploaddate__videoid_videoname.json (double underscore variant)
+    Example: 1222079676_20080922_PLHlE5YN3LE_Joulua Odotellessa.json
+    """
+    basename = os.path.splitext(filename)[0]  # Remove .json extension
+    parts = basename.split('_')
+
+    # Handle both single and double underscore between date and videoid
+    # After splitting, an empty string appears where there were consecutive underscores
+    if len(parts) < 4:
+        return None, None  # Invalid format
+
+    # Filter out empty strings from double underscores
+    parts = [p for p in parts if p]
+
+    if len(parts) < 3:
+        return None, None  # Invalid format after filtering
+
+    youtube_id = parts[2]
+    video_name = '_'.join(parts[3:]) if len(parts) > 3 else ''  # In case video name contains underscores
+    return youtube_id, video_name
+
+def extract_upload_date(filename):
+    """
+    Extract the upload date from the filename as a YYYYMMDD string, or None.
+    Example: 1222079676_20080922_PLHlE5YN3LE_Joulua Odotellessa.json -> "20080922"
+    """
+    parts = [p for p in os.path.splitext(filename)[0].split('_') if p]
+    if len(parts) < 3 or len(parts[1]) != 8 or not parts[1].isdigit():
+        return None
+    return parts[1]
+
+def parse_date(text, end=False):
+    """
+    Parse YYYY, YYYY-MM, YYYY-MM-DD or YYYYMMDD into a YYYYMMDD string.
+    Partial dates expand to their first day, or to their last day with end=True.
+    Raises ValueError for anything else.
+    """
+    digits = text.strip().replace('-', '')
+    if not digits.isdigit() or len(digits) not in (4, 6, 8):
+        raise ValueError(f"Invalid date '{text}', expected YYYY, YYYY-MM or YYYY-MM-DD.")
+    padding = "1231" if end else "0101"
+    return digits + padding[len(digits) - 4:]
+
+def in_date_range(filename, search_filter):
+    """
+    Check whether the upload date in the filename is inside the filter's date range.
+    Files without a parsable date only pass when no date range is set.
+    """
+    if search_filter.from_date is None and search_filter.to_date is None:
+        return True
+    upload_date = extract_upload_date(filename)
+    if upload_date is None:
+        return False
+    if search_filter.from_date is not None and upload_date < search_filter.from_date:
+        return False
+    return search_filter.to_date is None or upload_date <= search_filter.to_date
+
+def in_time_window(start_ms, search_filter):
+    """
+    Check whether a word starting at start_ms is inside the filter's in-video time window.
+    """
+    if search_filter.start_ms is not None and start_ms < search_filter.start_ms:
+        return False
+    return search_filter.end_ms is None or start_ms < search_filter.end_ms
+
+def list_transcripts(output_folder):
+    """
+    Return the sorted list of transcription JSON filenames in the output folder.
+    Raises FileNotFoundError if the folder does not exist.
+    """
+    return sorted(f for f in os.listdir(output_folder) if f.endswith('.json'))
+
+def plan_chunks(items, weights, worker_count, min_chunk_fraction=1 / 32):
+    """
+    Group items into chunks for a process pool, longest-processing-time first.
+
+    Items are sorted by weight (file size or word count), largest first, and cut into chunks
+    whose target weight shrinks with the work left: remaining / (2 * worker_count), but never
+    below min_chunk_fraction of a worker's fair share. Submitted in this order, the biggest
+    transcripts start first and the many small chunks at the end are pulled from the pool's
+    shared queue by whichever worker goes idle, which balances the tail like work stealing.
+
+    Returns a list of chunks, each a list of items, in submission order.
+    """
+    order = sorted(range(len(items)), key=lambda i: -weights[i])
+    remaining = sum(weights)
+    min_weight = remaining / worker_count * min_chunk_fraction
+
+    chunks = []
+    chunk = []
+    chunk_weight = 0
+    for i in order:
+        chunk.append(items[i])
+        chunk_weight += weights[i]
+        if chunk_weight >= max(remaining / (2 * worker_count), min_weight):
+            chunks.append(chunk)
+            remaining -= chunk_weight
+            chunk = []
+            chunk_weight = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks